@@ -14,7 +14,6 @@ __date__ = '05/15/2016'
 __revision__ = '$Format:%H$'
 
 
-import requests
 import json
 
 from .base import OAuth2FilterBase
@@ -31,7 +30,7 @@ class OAuth2FilterAuth0(OAuth2FilterBase):
         """
         if not self.verify_url:
             return False
-        response = requests.get(self.verify_url, headers={'Authorization', 'Bearer %s' % access_token})
+        response = self.http.get(self.verify_url, headers={'Authorization': 'Bearer %s' % access_token})
         # Invalid token returns 400
         if response.status_code != 200:
             return False
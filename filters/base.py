@@ -17,8 +17,14 @@ from qgis.server import *
 from qgis.core import *
 
 import urlparse
-from time import time
+from time import time, sleep
 import hashlib
+import hmac
+import base64
+import binascii
+import random
+import json
+import requests
 
 try:
     from oauth2lib.client import Client
@@ -26,113 +32,37 @@ except ImportError:
     raise Exception("Please install the required Python packages in REQUIREMENTS.txt")
 
 from oauth_settings import *
+from oauth_http import http_client
+from oauth_jwt import JwksValidator
+from oauth_session import SessionCookie
+from oauth_storage import (SqliteCache, MemoryCache, TokenRecordSerializer,
+                           make_storage, token_cache, token_record)
 
 import os
-import errno
-import sqlite3
+import threading
+from multiprocessing.pool import ThreadPool
 
-from cPickle import loads, dumps
+class OAuthException(Exception):
+    pass
 
-try:
-    from thread import get_ident
-except ImportError:
-    from dummy_thread import get_ident
-from werkzeug.contrib.cache import BaseCache
-
-class SqliteCache(BaseCache):
-    _create_sql = (
-            'CREATE TABLE IF NOT EXISTS bucket '
-            '('
-            '  key TEXT PRIMARY KEY,'
-            '  val BLOB,'
-            '  exp FLOAT'
-            ')'
-            )
-    _get_sql = 'SELECT val, exp FROM bucket WHERE key = ?'
-    _del_sql = 'DELETE FROM bucket WHERE key = ?'
-    _set_sql = 'REPLACE INTO bucket (key, val, exp) VALUES (?, ?, ?)'
-    _add_sql = 'INSERT INTO bucket (key, val, exp) VALUES (?, ?, ?)'
-
-    def __init__(self, path, default_timeout=3600):
-        self.path = os.path.abspath(path)
-        try:
-            os.mkdir(self.path)
-        except OSError, e:
-            if e.errno != errno.EEXIST or not os.path.isdir(self.path):
-                raise
-        self.default_timeout = default_timeout
-        self.connection_cache = {}
-
-    def _get_conn(self, key):
-        key = str(dumps(key, 0))
-        t_id = get_ident()
-        if t_id not in self.connection_cache:
-            self.connection_cache[t_id] = {}
-        if key not in self.connection_cache[t_id]:
-            bucket_name = str(hash(key))
-            bucket_path = os.path.join(self.path, bucket_name)
-            conn = sqlite3.Connection(bucket_path, timeout=60)
-            with conn:
-                conn.execute(self._create_sql)
-            self.connection_cache[t_id][key] = conn
-        return self.connection_cache[t_id][key]
-
-    def __delitem__(self, key):
-        key = str(key)
-        self.delete(key)
-
-    def __getitem__(self, key):
-        val = self.get(key)
-        if val is None:
-            raise KeyError
-        return val
-
-    def __setitem__(self, key, value):
-        return self.set(key, value)
-
-    def get(self, key):
-        key = str(key)
-        rv = None
-        with self._get_conn(key) as conn:
-            for row in conn.execute(self._get_sql, (key,)):
-                expire = row[1]
-                if expire > time():
-                    rv = loads(str(row[0]))
-                break
-        return rv
-
-    def delete(self, key):
-        key = str(key)
-        with self._get_conn(key) as conn:
-            conn.execute(self._del_sql, (key,))
-
-    def set(self, key, value, timeout=None):
-        key = str(key)
-        if not timeout:
-            timeout = self.default_timeout
-        value = buffer(dumps(value, 2))
-        expire = time() + timeout
-        with self._get_conn(key) as conn:
-            conn.execute(self._set_sql, (key, value, expire))
-
-    def add(self, key, value, timeout=None):
-        key = str(key)
-        if not timeout:
-            timeout = self.default_timeout
-        expire = time() + timeout
-        value = buffer(dumps(value, 2))
-        with self._get_conn(key) as conn:
-            try:
-                conn.execute(self._add_sql, (key, value, expire))
-            except sqlite3.IntegrityError:
-                pass
 
-    def clear(self):
-        for bucket in os.listdir(self.path):
-            os.unlink(os.path.join(self.path, bucket))
+class VerifyCall(object):
+    """A verification in progress, shared by the concurrent requests"""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = False
+
+class RequestContext(object):
+    """State of the request being processed, set by requestReady()"""
+
+    def __init__(self):
+        self.redirect_url = None
+        self.access_token = None
+        self.session_cookie = None
+        self.exception = None
+        self.error_code = '401 Unauthorized'
 
-class OAuthException(Exception):
-    pass
 
 class OAuth2FilterBase(QgsServerFilter):
     """
@@ -154,10 +84,57 @@ class OAuth2FilterBase(QgsServerFilter):
 
     scope = OAUTH2_SCOPE
 
+    # Pooled HTTP client for the provider endpoints
+    http = http_client
+
+    # Token introspection (RFC 7662) endpoint
+    verify_url = OAUTH2_VERIFY_URL
+
+    # Local JWT validation (when OAUTH2_JWT_VERIFY is on): JWKS URL and
+    # accepted issuers (a string or a tuple)
+    jwks_url = OAUTH2_JWKS_URL
+    jwt_issuer = OAUTH2_JWT_ISSUER
+
     # Store request_token -> dicts of request_token information
-    request_storage = SqliteCache('/tmp/outh2_request_storage')
-    # Store oauth_token -> dict of oauth token information
-    token_storage = SqliteCache('/tmp/outh2_token_storage')
+    request_storage = make_storage('request')
+    # Store oauth_token -> token record (see store_access_token())
+    token_storage = token_cache(make_storage('token',
+                                             stale_grace=OAUTH2_STALE_GRACE,
+                                             serializer=TokenRecordSerializer()))
+    # Store access_token -> True for tokens that failed verification,
+    # the hits are the verify calls saved
+    rejected_tokens = MemoryCache(OAUTH2_NEGATIVE_CACHE_SIZE,
+                                  OAUTH2_NEGATIVE_CACHE_TTL)
+    # Store access_token -> pid of the process verifying the token
+    verify_leases = make_storage('lease',
+                                 default_timeout=OAUTH2_VERIFY_LEASE_TIMEOUT)
+    # access_token -> VerifyCall in progress in this process
+    verify_calls = {}
+    verify_calls_lock = threading.Lock()
+    verify_pool = None
+    verify_pool_pid = None
+    # access_token -> last time it was used, for the background refresh
+    used_tokens = {}
+    # access_tokens queued for refresh
+    refreshing_tokens = set()
+    refresher_pid = None
+    refresher_lock = threading.Lock()
+    # RequestContext of the request processed by each thread: a single
+    # filter instance serves concurrent requests
+    request_contexts = threading.local()
+
+    @property
+    def context(self):
+        """RequestContext of the current request"""
+        context = getattr(self.request_contexts, 'context', None)
+        if context is None:
+            context = self.new_context()
+        return context
+
+    def new_context(self):
+        """Start a new RequestContext for the current thread"""
+        context = self.request_contexts.context = RequestContext()
+        return context
 
     def log(self, msg):
         QgsMessageLog.logMessage('[OAUTH2] %s' % msg)
@@ -175,11 +152,11 @@ class OAuth2FilterBase(QgsServerFilter):
         return self.get_current_url()
 
     def redirect(self, url):
-        self.log('Redirecting: %s' % self.redirect_url)
+        self.log('Redirecting: %s' % url)
         request = self.serverInterface().requestHandler()
         request.clearHeaders()
         request.setHeader('Status', '302 Found')
-        request.setHeader('Location', self.redirect_url)
+        request.setHeader('Location', url)
         request.clearBody()
         request.appendBody('Redirecting...')
 
@@ -187,30 +164,61 @@ class OAuth2FilterBase(QgsServerFilter):
         request = self.serverInterface().requestHandler()
         request.clearHeaders()
         if code == 401:
-            resp_code = '401 Unauthorized %s' % self.exception
+            resp_code = '401 Unauthorized %s' % self.context.exception
             request.setHeader(' WWW-Authenticate', 'Bearer realm="QGIS Server"')
         else:
-            resp_code = '500 Internal Server Error %s' % self.exception
-        self.log('Sending error: %s' % self.exception)
+            resp_code = '500 Internal Server Error %s' % self.context.exception
+        self.log('Sending error: %s' % self.context.exception)
         request.setHeader('Status', resp_code)
         request.clearBody()
-        request.appendBody('401 Unauthorized: %s' % self.exception)
+        request.appendBody('401 Unauthorized: %s' % self.context.exception)
 
-    def login(self):
+    def make_state(self, callback_url):
+        """
+        Pack callback_url, a nonce and an expiry in a compact HMAC-signed
+        state: no server-side storage is needed. The state can be replayed
+        until it expires, the authorization code it comes with cannot.
+        """
+        payload = '%x:%s:%s' % (int(time() + OAUTH2_STATE_TTL),
+                                binascii.hexlify(os.urandom(8)), callback_url)
+        signature = hmac.new(OAUTH2_STATE_SECRET, payload, hashlib.sha256).digest()[:16]
+        return '%s.%s' % (base64.urlsafe_b64encode(payload).rstrip('='),
+                          base64.urlsafe_b64encode(signature).rstrip('='))
+
+    def parse_state(self, state):
+        """
+        Return the callback_url packed in a signed state
+        Raise OAuthException if the state is invalid or expired.
+        """
         try:
-            request_token = self.request_storage['request_token']
-        except KeyError:
-            # Step 1. Get (build) an authorization code
-            request_token = hashlib.md5(str(time())).hexdigest()
+            payload, signature = [base64.urlsafe_b64decode(str(part) + '=' * (-len(part) % 4))
+                                  for part in state.split('.')]
+            expected = hmac.new(OAUTH2_STATE_SECRET, payload, hashlib.sha256).digest()[:16]
+            if not hmac.compare_digest(signature, expected):
+                raise ValueError('bad signature')
+            expire, nonce, callback_url = payload.split(':', 2)
+        except (ValueError, TypeError):
+            raise OAuthException("Invalid request_token %s!" % state)
+        if int(expire, 16) < time():
+            raise OAuthException("Expired request_token %s!" % state)
+        return callback_url
+
+    def login(self):
+        # Step 1. Get (build) an authorization code
+        if OAUTH2_STATELESS_STATE:
+            request_token = self.make_state(self.get_current_url())
+        else:
+            request_token = binascii.hexlify(os.urandom(16))
             # Step 2. Store the request token and the current URL in a session for later use.
-            self.request_storage[request_token] = self.get_current_url()
+            self.request_storage.set(request_token, self.get_current_url(),
+                                     OAUTH2_STATE_TTL)
         # Step 3. Redirect the user to the authentication URL.
         client = Client(OAUTH2_CLIENT_ID, OAUTH2_CLIENT_SECRET,
                         self.get_callback_url(), self.authenticate_url,
                         self.access_token_url)
-        self.redirect_url = client.get_authorization_code_uri(state=request_token)
+        self.context.redirect_url = client.get_authorization_code_uri(state=request_token)
         if self.scope is not None:
-            self.redirect_url += '&scope=%s' % self.scope
+            self.context.redirect_url += '&scope=%s' % self.scope
 
     def authenticated(self, request_token, verifier_token):
         """
@@ -219,10 +227,13 @@ class OAuth2FilterBase(QgsServerFilter):
         Raise OAuthException on error.
         """
         # Check the verifier_token (state)
-        try:
-            real_callback_url = self.request_storage[request_token]
-        except KeyError:
-            raise OAuthException("Invalid request_token %s!" % request_token)
+        if OAUTH2_STATELESS_STATE:
+            real_callback_url = self.parse_state(request_token)
+        else:
+            try:
+                real_callback_url = self.request_storage[request_token]
+            except KeyError:
+                raise OAuthException("Invalid request_token %s!" % request_token)
         iface = self.serverInterface()
         request = iface.requestHandler()
         # Step 1. Use the request token in the session to build a new client.
@@ -243,12 +254,13 @@ class OAuth2FilterBase(QgsServerFilter):
          u'id_token': u'uG6K7zS0F4VUsaQmZSE4h81Q'}
         """
         self.log('authenticated() Got content: %s' % content )
-        del self.request_storage[request_token]
+        if not OAUTH2_STATELESS_STATE:
+            del self.request_storage[request_token]
         try:
             access_token = dict(urlparse.parse_qsl(content))
         except AttributeError:
             access_token = content
-        self.token_storage[access_token['access_token']] = access_token
+        self.store_access_token(access_token['access_token'], access_token)
         self.log('authenticated() Storing access_token %s' % access_token)
         # Clear the parameterMap
         request.removeParameter('ACCESS_TOKEN')
@@ -260,10 +272,308 @@ class OAuth2FilterBase(QgsServerFilter):
         """
         This is not implemented by all providers (Google and Auth0 do)
         The RFC is: https://tools.ietf.org/html/rfc7662
-        Default implementation return False
-        OAUTH2_VERIFY_URL env var can be used to specify the verify URL
+        Default implementation calls the introspection endpoint set in
+        OAUTH2_VERIFY_URL authenticating as the client, return False if
+        it is not set.
+        Returns the introspection response of an active token
+        """
+        if not self.verify_url:
+            return False
+        response = self.http.post(self.verify_url,
+                                  data={'token': access_token,
+                                        'token_type_hint': 'access_token'},
+                                  auth=(OAUTH2_CLIENT_ID, OAUTH2_CLIENT_SECRET),
+                                  headers={'Accept': 'application/json'})
+        if response.status_code != 200:
+            return False
+        try:
+            profile = json.loads(response.text)
+            if profile.get('active') is not True:
+                return False
+            if 'exp' in profile and float(profile['exp']) <= time():
+                return False
+            return profile
+        except (ValueError, TypeError, AttributeError):
+            return False
+
+    def get_jwt_validator(self):
+        """Return the (per class) JwksValidator, None if disabled"""
+        if not OAUTH2_JWT_VERIFY or not self.jwks_url:
+            return None
+        klass = type(self)
+        if klass.__dict__.get('jwt_validator') is None:
+            klass.jwt_validator = JwksValidator(self.jwks_url, self.jwt_issuer)
+        return klass.jwt_validator
+
+    def verify_jwt_access_token(self, access_token):
+        """
+        Validate a JWT access_token locally, return the claims, False if
+        the token is not valid and None if it cannot be validated locally.
+        """
+        validator = self.get_jwt_validator()
+        if validator is None:
+            return None
+        return validator.validate(access_token)
+
+    def get_token_timeout(self, token_info):
         """
-        return False
+        Return the number of seconds token_info can be cached: its remaining
+        lifetime (expires_in or exp) capped, or the floored default when the
+        provider did not return it, jittered so that the expiries of the
+        tokens do not line up. Return 0 for an expired token.
+        """
+        remaining = None
+        try:
+            if token_info.get('expires_in') is not None:
+                remaining = float(token_info['expires_in'])
+            elif token_info.get('exp') is not None:
+                remaining = float(token_info['exp']) - time()
+        except (AttributeError, TypeError, ValueError):
+            pass
+        if remaining is None:
+            timeout = max(OAUTH2_TOKEN_TTL_MIN,
+                          min(OAUTH2_TOKEN_TTL_MAX, OAUTH2_TOKEN_TTL_DEFAULT))
+        elif remaining <= 0:
+            return 0
+        else:
+            # Never cache beyond the expiry
+            timeout = min(OAUTH2_TOKEN_TTL_MAX, remaining)
+        # Only shorten
+        return timeout * (1 - random.uniform(0, OAUTH2_TOKEN_TTL_JITTER))
+
+    def store_access_token(self, access_token, token_info, timeout=None):
+        """
+        Store the token record of token_info (only the fields used by the
+        filter) in token_storage, for timeout or get_token_timeout() seconds,
+        an expired token is not stored
+        """
+        if timeout is None:
+            timeout = self.get_token_timeout(token_info)
+        if timeout <= 0:
+            return
+        self.token_storage.set(access_token, token_record(token_info), timeout)
+
+    def verify_and_store_access_token(self, access_token):
+        """
+        Call verify_access_token() and store the result in token_storage
+        or in rejected_tokens. A rejected token is also deleted from
+        token_storage: its stale entry must not be accepted again.
+        Return the profile, False if the token was rejected or None if the
+        provider could not be reached.
+        """
+        try:
+            profile = self.verify_access_token(access_token)
+        except requests.RequestException, e:
+            self.log('Cannot call the verify endpoint: %s' % e)
+            return None
+        if profile:
+            self.store_access_token(access_token, profile)
+        else:
+            self.rejected_tokens[access_token] = True
+            self.token_storage.delete(access_token)
+        return profile
+
+    def verify_leased_access_token(self, access_token):
+        """
+        Verify the access_token holding a lease in verify_leases, if another
+        process holds the lease wait for its result in token_storage.
+        """
+        if self.verify_leases.add(access_token, os.getpid()):
+            try:
+                return self.verify_and_store_access_token(access_token)
+            finally:
+                self.verify_leases.delete(access_token)
+        self.log('Waiting for the verification of access_token in another process')
+        deadline = time() + OAUTH2_VERIFY_LEASE_TIMEOUT
+        while time() < deadline:
+            sleep(OAUTH2_VERIFY_LEASE_POLL)
+            profile = self.token_storage.get(access_token)
+            if profile:
+                return profile
+            if self.verify_leases.get(access_token) is None:
+                # Released without storing the token: rejected or failed
+                return None
+        # The other process is stuck: do it ourselves
+        return self.verify_and_store_access_token(access_token)
+
+    def get_verify_pool(self):
+        """Return the verification thread pool of this process"""
+        with self.verify_calls_lock:
+            if self.verify_pool_pid != os.getpid():
+                OAuth2FilterBase.verify_pool = ThreadPool(OAUTH2_VERIFY_WORKERS)
+                OAuth2FilterBase.verify_pool_pid = os.getpid()
+            return self.verify_pool
+
+    def run_verify_call(self, access_token, call):
+        try:
+            call.result = self.verify_leased_access_token(access_token)
+        except Exception, e:
+            self.log('Cannot verify access_token: %s' % e)
+            call.result = None
+        finally:
+            with self.verify_calls_lock:
+                del self.verify_calls[access_token]
+            call.event.set()
+
+    def start_verify_call(self, access_token):
+        """
+        Return the VerifyCall in progress for access_token, start a new one
+        in the verification pool if there is none.
+        """
+        pool = self.get_verify_pool()
+        with self.verify_calls_lock:
+            call = self.verify_calls.get(access_token)
+            if call is not None:
+                return call
+            call = self.verify_calls[access_token] = VerifyCall()
+        pool.apply_async(self.run_verify_call, (access_token, call))
+        return call
+
+    def verify_access_token_once(self, access_token):
+        """
+        Coalesce the concurrent verifications of the same access_token in
+        one call to the provider, wait at most OAUTH2_AUTH_BUDGET seconds.
+        Return the profile, False if rejected or None if the token could
+        not be verified.
+        """
+        call = self.start_verify_call(access_token)
+        if not call.event.wait(OAUTH2_AUTH_BUDGET):
+            self.log('access_token verification exceeded the latency budget')
+            return None
+        return call.result
+
+    def refresh_access_token(self, refresh_token):
+        """
+        Call the token endpoint with a refresh_token grant (RFC 6749 section 6)
+        Return the new token information or False
+        """
+        response = self.http.post(self.access_token_url,
+                                  data={'grant_type': 'refresh_token',
+                                        'refresh_token': refresh_token,
+                                        'client_id': OAUTH2_CLIENT_ID,
+                                        'client_secret': OAUTH2_CLIENT_SECRET},
+                                  headers={'Accept': 'application/json'})
+        if response.status_code != 200:
+            return False
+        try:
+            token_info = json.loads(response.text)
+        except ValueError:
+            token_info = dict(urlparse.parse_qsl(response.text))
+        if not token_info.get('access_token'):
+            return False
+        return token_info
+
+    def refresh_stored_access_token(self, access_token, token_info):
+        """
+        Extend the life of a stored access_token: re-verify the token, or,
+        with OAUTH2_REFRESH_EXTEND_TOKENS, use the refresh_token if the
+        provider returned one.
+        """
+        try:
+            refresh_token = None
+            if OAUTH2_REFRESH_EXTEND_TOKENS and isinstance(token_info, dict):
+                refresh_token = token_info.get('refresh_token')
+            if refresh_token:
+                new_info = self.refresh_access_token(refresh_token)
+                if new_info:
+                    new_info.setdefault('refresh_token', refresh_token)
+                    # The client keeps using the old access_token: it is
+                    # accepted beyond its own expiry
+                    timeout = self.get_token_timeout(new_info)
+                    self.store_access_token(access_token, new_info, timeout)
+                    self.log('access_token refreshed')
+                    return
+            if getattr(self, 'verify_url', None):
+                if self.verify_and_store_access_token(access_token) is False:
+                    self.log('access_token is no more valid')
+                    self.used_tokens.pop(access_token, None)
+        except Exception, e:
+            self.log('Cannot refresh access_token: %s' % e)
+        finally:
+            self.refreshing_tokens.discard(access_token)
+
+    def queue_refreshes(self, pool):
+        """Queue the refresh of the tokens in use which are about to expire"""
+        now = time()
+        for access_token, used in self.used_tokens.items():
+            if now - used > OAUTH2_REFRESH_IDLE:
+                self.used_tokens.pop(access_token, None)
+                continue
+            if access_token in self.refreshing_tokens:
+                continue
+            try:
+                token_info, expire = self.token_storage.get_with_expiry(access_token)
+            except Exception, e:
+                self.log('Cannot check access_token expiry: %s' % e)
+                continue
+            if token_info is None:
+                self.used_tokens.pop(access_token, None)
+                continue
+            if expire - now >= OAUTH2_REFRESH_AHEAD:
+                continue
+            if not (OAUTH2_REFRESH_EXTEND_TOKENS and token_info.get('refresh_token')):
+                # Verifying the token again cannot extend it beyond its
+                # expiry at the provider
+                if token_info.get('exp') and token_info['exp'] - now < OAUTH2_REFRESH_AHEAD:
+                    continue
+            self.refreshing_tokens.add(access_token)
+            pool.apply_async(self.refresh_stored_access_token,
+                             (access_token, token_info))
+
+    def _refresher(self, pool):
+        while True:
+            sleep(OAUTH2_REFRESH_INTERVAL)
+            self.queue_refreshes(pool)
+
+    def touch_access_token(self, access_token):
+        """Mark access_token as in use, start the refresher if needed"""
+        if OAUTH2_REFRESH_AHEAD <= 0:
+            return
+        self.used_tokens[access_token] = time()
+        if self.refresher_pid == os.getpid():
+            return
+        with self.refresher_lock:
+            if self.refresher_pid == os.getpid():
+                return
+            OAuth2FilterBase.refresher_pid = os.getpid()
+        pool = ThreadPool(OAUTH2_REFRESH_WORKERS)
+        refresher = threading.Thread(target=self._refresher, args=(pool,),
+                                     name='oauth2-refresher')
+        refresher.daemon = True
+        refresher.start()
+
+    def get_session_cookies(self):
+        """Return the (per class) SessionCookie, None if disabled"""
+        if not OAUTH2_SESSION_COOKIE:
+            return None
+        klass = type(self)
+        if klass.__dict__.get('session_cookies') is None:
+            klass.session_cookies = SessionCookie()
+        return klass.session_cookies
+
+    def get_session(self):
+        """Return the session carried by a valid session cookie, None otherwise"""
+        session_cookies = self.get_session_cookies()
+        if session_cookies is None:
+            return None
+        return session_cookies.from_header(self.serverInterface().getEnv('HTTP_COOKIE'))
+
+    def set_session_cookie(self, access_token, token_info):
+        """Issue a session cookie for a verified access_token (if enabled)"""
+        session_cookies = self.get_session_cookies()
+        if session_cookies is None:
+            return
+        timeout = self.get_token_timeout(token_info)
+        if timeout < 1:
+            # Max-Age=0 would delete the cookie
+            return
+        subject = None
+        if isinstance(token_info, dict):
+            subject = (token_info.get('sub') or token_info.get('email')
+                       or token_info.get('login'))
+        self.context.session_cookie = session_cookies.header(
+            access_token, timeout, subject,
+            self.serverInterface().getEnv('HTTPS') == 'on')
 
     def get_access_token(self):
         """
@@ -278,7 +588,7 @@ class OAuth2FilterBase(QgsServerFilter):
         if not auth_header:
             auth_header = self.serverInterface().getEnv('HTTP_AUTHORIZATION')
         if auth_header.find('Bearer ') == 0:
-            access_token = auth_header[6:]
+            access_token = auth_header[7:].strip()
             self.log('Got HTTP_AUTHORIZATION bearer: %s' % access_token)
         # 2: search in the query string ...
         #    or search in the POST body
@@ -286,21 +596,53 @@ class OAuth2FilterBase(QgsServerFilter):
             access_token = params.get('ACCESS_TOKEN', None)
             if access_token:
                 self.log('Got access_token from requests: %s' % access_token)
-        # 3: verify the access_token we have found in header or request
+        # 3: search in the session cookie, it only stands for the token it
+        #    was issued for: another token (e.g. a new login) is verified
+        session = self.get_session()
+        if session is not None and (not access_token or session['t'] == access_token):
+            self.log('Got a valid session cookie')
+            return session['t']  # is valid!
+        # 4: verify the access_token we have found in header or request
         if access_token:
             # Search in cache
-            if self.token_storage.get(access_token):
+            token_info = self.token_storage.get(access_token)
+            if token_info:
                 self.log('access_token is verified!')
+                self.touch_access_token(access_token)
+                self.set_session_cookie(access_token, token_info)
                 return access_token  # is valid!
             else:
                 self.log('access_token is NOT verified [1]!')
+                # Signed JWT: no need to call verify_url
+                claims = self.verify_jwt_access_token(access_token)
+                if claims:
+                    self.log('access_token is a valid JWT!')
+                    self.set_session_cookie(access_token, claims)
+                    return access_token  # is valid!
+                if claims is False:
+                    raise OAuthException('access_token is NOT a valid JWT!')
+                # Recently rejected: do not call verify_url again (and do
+                # not accept it as stale)
+                if self.rejected_tokens.get(access_token):
+                    raise OAuthException('access_token is NOT verified!')
+                # Recently expired: accept it while it is verified again,
+                # a rejection deletes the stale entry
+                if OAUTH2_STALE_GRACE and getattr(self, 'verify_url', None):
+                    if self.token_storage.get_stale(access_token)[0] is not None:
+                        self.log('access_token is stale, verifying it again')
+                        self.start_verify_call(access_token)
+                        self.touch_access_token(access_token)
+                        return access_token  # is valid (for now)!
                 # Check verify_url
-                profile = self.verify_access_token(access_token)
+                profile = self.verify_access_token_once(access_token)
                 if profile:
-                    self.token_storage[access_token] = profile
+                    self.touch_access_token(access_token)
+                    self.set_session_cookie(access_token, profile)
                     return access_token  # is valid!
+                if profile is None:
+                    raise OAuthException('Cannot verify access_token!')
                 raise OAuthException('access_token is NOT verified!')
-        # 4: Search for token from verify step
+        # 5: Search for token from verify step
         #    NOTE: this is not the access_token but a request_token!
         verifier_token = params.get('CODE', None)
         request_token = params.get('STATE', None)
@@ -315,7 +657,7 @@ class OAuth2FilterBase(QgsServerFilter):
                 query_params['access_token'] = access_token
                 query = '&'.join(["%s=%s" % (k, v) for k, v in query_params.items()])
                 url = urlparse.urlunparse((scheme, domain, path, params, query, fragment))
-                self.redirect_url = url
+                self.context.redirect_url = url
                 return None
             except Exception, e:
                 self.log('Cannot verify access_token: %s' % e)
@@ -323,32 +665,30 @@ class OAuth2FilterBase(QgsServerFilter):
         return None
 
     def requestReady(self):
-        self.redirect_url = None
-        self.access_token = None
-        self.exception = None
-        self.error_code = '401 Unauthorized'
+        context = self.new_context()
         request = self.serverInterface().requestHandler()
         params = request.parameterMap()
         for k, v in params.items():
             self.log('Request parameters: %s: %s' % (k, v))
         # Check settings:
         if not OAUTH2_CLIENT_ID or not OAUTH2_CLIENT_SECRET:
-            self.exception = OAuthException('Configuration error: OAUTH2_CLIENT_ID or OAUTH2_CLIENT_SECRET are not set!')
-            self.error_code = '500 Internal Server Error'
+            context.exception = OAuthException('Configuration error: OAUTH2_CLIENT_ID or OAUTH2_CLIENT_SECRET are not set!')
+            context.error_code = '500 Internal Server Error'
             request.setParameter('REQUEST', 'OAUTH2')
         else:
             # Try to get a valid access_token
             try:
-                self.access_token = self.get_access_token()
+                context.access_token = self.get_access_token()
             except OAuthException, e:
-                self.exception = e
-            if self.access_token is None:  # We need to login: skip the core server processing
+                context.exception = e
+            if context.access_token is None:  # We need to login: skip the core server processing
                 request.setParameter('REQUEST', 'OAUTH2')
 
     def responseComplete(self):
+        context = self.context
         request = self.serverInterface().requestHandler()
         # REQUEST is OAUTH2: we need to login
-        if request.parameterMap().get('REQUEST') == 'OAUTH2' and not self.redirect_url:
+        if request.parameterMap().get('REQUEST') == 'OAUTH2' and not context.redirect_url:
             try:
                 # Check if the auth was denied
                 if request.parameterMap().get('DENIED'):
@@ -356,10 +696,12 @@ class OAuth2FilterBase(QgsServerFilter):
                 self.login()
             except OAuthException, e:
                 # Set an error
-                self.exception = e
+                context.exception = e
         # Handle redirects, can be set by login() or authenticated()
-        if self.redirect_url:
-            self.redirect(self.redirect_url)
+        if context.redirect_url:
+            self.redirect(context.redirect_url)
         # Handle errors
-        if self.exception is not None:
-            self.error(self.error_code)
+        if context.exception is not None:
+            self.error(context.error_code)
+        elif context.session_cookie and not context.redirect_url:
+            request.setHeader('Set-Cookie', context.session_cookie)
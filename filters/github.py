@@ -13,7 +13,6 @@ __date__ = '05/15/2016'
 # This will get replaced with a git SHA1 when you do a git archive
 __revision__ = '$Format:%H$'
 
-import requests
 import json
 
 from .base import OAuth2FilterBase
@@ -31,7 +30,7 @@ class OAuth2FilterGithub(OAuth2FilterBase):
         This is not implemented by all providers (Google does)
         Returns the user profile as returned by the verify endpoint
         """
-        response = requests.get(self.verify_url + access_token)
+        response = self.http.get(self.verify_url + access_token)
         # Invalid token returns 401
         if response.status_code != 200:
             return False
@@ -15,7 +15,6 @@ __revision__ = '$Format:%H$'
 
 
 import urlparse
-import requests
 import json
 
 from .base import OAuth2FilterBase
@@ -30,6 +29,9 @@ class OAuth2FilterGoogle(OAuth2FilterBase):
     scope = 'profile'
     # Verify the token
     verify_url = 'https://www.googleapis.com/oauth2/v3/tokeninfo?access_token='
+    # Validate JWTs locally
+    jwks_url = OAUTH2_JWKS_URL or 'https://www.googleapis.com/oauth2/v3/certs'
+    jwt_issuer = OAUTH2_JWT_ISSUER or ('https://accounts.google.com', 'accounts.google.com')
 
     def get_callback_url(self):
         """Google does not like the query string in the redirect_url"""
@@ -41,7 +43,7 @@ class OAuth2FilterGoogle(OAuth2FilterBase):
         This is not implemented by all providers (Google does)
         Returns the user profile as returned by the verify endpoint
         """
-        response = requests.get(self.verify_url + access_token)
+        response = self.http.get(self.verify_url + access_token)
         # Invalid token returns 400
         if response.status_code != 200:
             return False
@@ -30,17 +30,25 @@ authenticate_url = 'https://api.twitter.com/oauth/authenticate'
 class OAuth2FilterTwitter(OAuth2FilterBase):
 
     consumer = oauth.Consumer(OAUTH2_CLIENT_ID, OAUTH2_CLIENT_SECRET)
+    signature_method = oauth.SignatureMethod_HMAC_SHA1()
+
+    def signed_get(self, url, token=None):
+        """Sign the url with the consumer (and token) and GET it through the pooled client"""
+        req = oauth.Request.from_consumer_and_token(self.consumer, token=token,
+                                                    http_method='GET', http_url=url)
+        req.sign_request(self.signature_method, self.consumer, token)
+        return self.http.get(req.to_url())
 
     def login(self):
         # Step 1. Get a request token from Twitter.
         callback_url = self.get_current_url()
         url = "%s?oauth_callback=%s" % (request_token_url, quote(callback_url))
         self.log('Calling login %s' % url)
-        client = oauth.Client(self.consumer)
-        resp, content = client.request(url, "GET")
-        self.log('login() Got response: %s' % resp )
+        response = self.signed_get(url)
+        content = response.text
+        self.log('login() Got response: %s' % response.status_code)
         self.log('login() Got content: %s' % content )
-        if resp['status'] != '200':
+        if response.status_code != 200:
             raise OAuthException("login() Invalid response from OAuth endpoint.")
         # Step 2. Store the request token in a session for later use.
         request_token = dict(urlparse.parse_qsl(content))
@@ -48,7 +56,7 @@ class OAuth2FilterTwitter(OAuth2FilterBase):
             raise OAuthException("login() Invalid callback.")
         self.request_storage[request_token['oauth_token']] = request_token
         # Step 3. Redirect the user to the authentication URL.
-        self.redirect_url = "%s?oauth_token=%s" % (authenticate_url, request_token['oauth_token'])
+        self.context.redirect_url = "%s?oauth_token=%s" % (authenticate_url, request_token['oauth_token'])
 
     def authenticated(self, request_token, verifier_token):
         """
@@ -62,12 +70,12 @@ class OAuth2FilterTwitter(OAuth2FilterBase):
         token = oauth.Token(request_token,
                             self.request_storage[request_token]['oauth_token_secret'])
         token.set_verifier(verifier_token)
-        client = oauth.Client(self.consumer, token)
 
         # Step 2. Request the authorized access token from Twitter.
         self.log('authenticated() Calling authenticated %s' % access_token_url)
-        resp, content = client.request(access_token_url, "GET")
-        if resp['status'] != '200':
+        response = self.signed_get(access_token_url, token)
+        content = response.text
+        if response.status_code != 200:
             print content
             raise OAuthException("authenticated() Invalid response from OAuth endpoint.")
         """
@@ -80,14 +88,14 @@ class OAuth2FilterTwitter(OAuth2FilterBase):
             'screen_name': 'heyismysiteup'
         }
         """
-        self.log('authenticated() Got response: %s' % resp )
+        self.log('authenticated() Got response: %s' % response.status_code)
         self.log('authenticated() Got content: %s' % content )
         # You may now access protected resources using the access tokens
         # You should store this access token somewhere safe, like a database,
         # for future use. The request_token can be thrown away
         del self.request_storage[request_token]
         access_token = dict(urlparse.parse_qsl(content))
-        self.token_storage[access_token['oauth_token']] = access_token
+        self.store_access_token(access_token['oauth_token'], access_token)
         self.log('authenticated() Storing access_token [%s] %s' % (access_token['oauth_token'], access_token))
         # Clear the parameterMap
         request.removeParameter('OAUTH_TOKEN')
@@ -104,7 +112,7 @@ class OAuth2FilterTwitter(OAuth2FilterBase):
         # 1: search in the bearer
         auth_header = params.get('HTTP_AUTHORIZATION', '')
         if auth_header.find('Bearer ') == 0:
-            access_token = auth_header[6:]
+            access_token = auth_header[7:].strip()
             self.log('get_access_token() Got HTTP_AUTHORIZATION bearer: %s' % access_token)
             # Search in cache
             if self.token_storage.get(access_token):
@@ -142,7 +150,7 @@ class OAuth2FilterTwitter(OAuth2FilterBase):
                 query_params['access_token'] = access_token
                 query = '&'.join(["%s=%s" % (k, v) for k, v in query_params.items()])
                 url = urlparse.urlunparse((scheme, domain, path, params, query, fragment))
-                self.redirect_url = url
+                self.context.redirect_url = url
                 return None
             except Exception as e:
                 self.log('get_access_token() Cannot verify access_token: %s' % e)
@@ -150,29 +158,27 @@ class OAuth2FilterTwitter(OAuth2FilterBase):
         return None
 
     def requestReady(self):
-        self.redirect_url = None
-        self.access_token = None
-        self.exception = None
-        self.error_code = '401 Unauthorized'
+        context = self.new_context()
         request = self.serverInterface().requestHandler()
         # Check settings:
         if not OAUTH2_CLIENT_ID or not OAUTH2_CLIENT_SECRET:
-            self.exception = OAuthException('Configuration error: OAUTH2_CLIENT_ID or OAUTH2_CLIENT_SECRET are not set!')
-            self.error_code = '500 Internal Server Error'
+            context.exception = OAuthException('Configuration error: OAUTH2_CLIENT_ID or OAUTH2_CLIENT_SECRET are not set!')
+            context.error_code = '500 Internal Server Error'
             request.setParameter('REQUEST', 'OAUTH2')
         else:
             # Try to get a valid access_token
             try:
-                self.access_token = self.get_access_token()
+                context.access_token = self.get_access_token()
             except Exception as e:
-                self.exception = e
-            if self.access_token is None:  # We need to login: skip the core server processing
+                context.exception = e
+            if context.access_token is None:  # We need to login: skip the core server processing
                 request.setParameter('REQUEST', 'OAUTH2')
 
     def responseComplete(self):
+        context = self.context
         request = self.serverInterface().requestHandler()
         # REQUEST is OAUTH2 and no redirect set: we need to login
-        if request.parameterMap().get('REQUEST') == 'OAUTH2' and not self.redirect_url:
+        if request.parameterMap().get('REQUEST') == 'OAUTH2' and not context.redirect_url:
             try:
                 # Check if the auth was denied
                 if request.parameterMap().get('DENIED'):
@@ -180,10 +186,10 @@ class OAuth2FilterTwitter(OAuth2FilterBase):
                 self.login()
             except OAuthException as e:
                 # Set an error
-                self.exception = e
+                context.exception = e
         # Handle redirects, can be set by login() or authenticated()
-        if self.redirect_url:
-            self.redirect(self.redirect_url)
+        if context.redirect_url:
+            self.redirect(context.redirect_url)
         # Handle errors
-        if self.exception is not None:
-            self.error(self.error_code)
+        if context.exception is not None:
+            self.error(context.error_code)
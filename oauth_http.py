@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+"""
+QGIS Server OAuth 2 pooled HTTP client for the provider endpoints
+
+.. note:: This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+"""
+
+__author__ = 'agent'
+__date__ = '10/18/2026'
+# This will get replaced with a git SHA1 when you do a git archive
+__revision__ = '$Format:%H$'
+
+import os
+import threading
+import urlparse
+from time import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
+
+from oauth_settings import *
+
+
+class CircuitOpenError(requests.RequestException):
+    """The endpoint is failing: the call was not attempted"""
+
+
+class CircuitBreaker(object):
+    """
+    Open after max_failures consecutive failed (or slower than slow_call)
+    calls, let a trial call through after reset_timeout seconds: close on
+    success, open again on failure.
+    """
+
+    def __init__(self, max_failures=OAUTH2_BREAKER_FAILURES,
+                 slow_call=OAUTH2_BREAKER_SLOW_CALL,
+                 reset_timeout=OAUTH2_BREAKER_RESET_TIMEOUT):
+        self.max_failures = max_failures
+        self.slow_call = slow_call
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trial = False
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if self.trial or time() - self.opened_at >= self.reset_timeout:
+            return 'half-open'
+        return 'open'
+
+    def allow(self):
+        if self.opened_at is None:
+            return True
+        if not self.trial and time() - self.opened_at >= self.reset_timeout:
+            self.trial = True
+            return True
+        return False
+
+    def record(self, elapsed, error):
+        if error or (self.slow_call and elapsed > self.slow_call):
+            self.failures += 1
+            if self.trial or self.failures >= self.max_failures:
+                self.opened_at = time()
+        else:
+            self.failures = 0
+            self.opened_at = None
+        self.trial = False
+
+
+class HttpClient(object):
+    """
+    Per-process pool of keep-alive HTTP connections, with timeouts, retries,
+    per-endpoint circuit breakers and latency statistics.
+    """
+
+    def __init__(self, pool_size=OAUTH2_HTTP_POOL_SIZE,
+                 connect_timeout=OAUTH2_HTTP_CONNECT_TIMEOUT,
+                 read_timeout=OAUTH2_HTTP_READ_TIMEOUT,
+                 retries=OAUTH2_HTTP_RETRIES,
+                 backoff=OAUTH2_HTTP_BACKOFF):
+        self.pool_size = pool_size
+        self.timeout = (connect_timeout, read_timeout)
+        self.retries = retries
+        self.backoff = backoff
+        self.session = None
+        self.session_pid = None
+        self.lock = threading.Lock()
+        # endpoint -> {'calls', 'errors', 'rejected', 'total_time', 'max_time'}
+        self.stats = {}
+        # endpoint -> CircuitBreaker
+        self.breakers = {}
+
+    def _get_session(self):
+        """Return the session of this process (sockets are not shared with a forked parent)"""
+        with self.lock:
+            if self.session_pid != os.getpid():
+                retry = Retry(total=self.retries, backoff_factor=self.backoff,
+                              status_forcelist=(502, 503, 504),
+                              raise_on_status=False)
+                adapter = HTTPAdapter(pool_connections=self.pool_size,
+                                      pool_maxsize=self.pool_size,
+                                      max_retries=retry)
+                self.session = requests.Session()
+                self.session.mount('http://', adapter)
+                self.session.mount('https://', adapter)
+                self.session_pid = os.getpid()
+            return self.session
+
+    @staticmethod
+    def endpoint(url):
+        """Statistics key: the URL without the query string (it may contain a token)"""
+        scheme, domain, path, params, query, fragment = urlparse.urlparse(url)
+        return urlparse.urlunparse((scheme, domain, path, '', '', ''))
+
+    def _get_stats(self, endpoint):
+        return self.stats.setdefault(endpoint, {'calls': 0, 'errors': 0,
+                                                'rejected': 0,
+                                                'total_time': 0.0,
+                                                'max_time': 0.0})
+
+    def _allow(self, endpoint):
+        with self.lock:
+            breaker = self.breakers.get(endpoint)
+            if breaker is None:
+                breaker = self.breakers[endpoint] = CircuitBreaker()
+            if breaker.allow():
+                return True
+            self._get_stats(endpoint)['rejected'] += 1
+            return False
+
+    def _record(self, endpoint, elapsed, error):
+        with self.lock:
+            self.breakers[endpoint].record(elapsed, error)
+            stats = self._get_stats(endpoint)
+            stats['calls'] += 1
+            stats['errors'] += error
+            stats['total_time'] += elapsed
+            stats['max_time'] = max(stats['max_time'], elapsed)
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        endpoint = self.endpoint(url)
+        if not self._allow(endpoint):
+            raise CircuitOpenError('Circuit open for %s' % endpoint)
+        session = self._get_session()
+        start = time()
+        error = True
+        try:
+            response = session.request(method, url, **kwargs)
+            error = response.status_code >= 500
+            return response
+        finally:
+            self._record(endpoint, time() - start, error)
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+
+# Shared by all the filters
+http_client = HttpClient()
@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+"""
+QGIS Server OAuth 2 local JWT validation against a cached JWKS
+
+.. note:: This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+"""
+
+__author__ = 'agent'
+__date__ = '10/18/2026'
+# This will get replaced with a git SHA1 when you do a git archive
+__revision__ = '$Format:%H$'
+
+import os
+import json
+import threading
+from time import time, sleep
+
+# Optional: only needed when OAUTH2_JWT_VERIFY is on
+try:
+    import jwt
+    from jwt.algorithms import get_default_algorithms
+except ImportError:
+    jwt = None
+
+from qgis.core import QgsMessageLog
+
+from oauth_settings import *
+from oauth_http import http_client
+
+
+class JwksValidator(object):
+    """
+    Validate signature, aud, iss and exp of JWTs with the keys of a JWKS,
+    the JWKS is fetched once, refreshed in the background and when a token
+    is signed with an unknown key (key rotation).
+    """
+
+    def __init__(self, jwks_url, issuer=None, audience=OAUTH2_JWT_AUDIENCE,
+                 algorithms=OAUTH2_JWT_ALGORITHMS,
+                 refresh_interval=OAUTH2_JWKS_REFRESH_INTERVAL,
+                 min_refresh_interval=OAUTH2_JWKS_MIN_REFRESH_INTERVAL,
+                 leeway=OAUTH2_JWT_LEEWAY, http=http_client):
+        if jwt is None:
+            raise Exception("Please install the required Python packages for JWT validation (PyJWT and cryptography)")
+        self.jwks_url = jwks_url
+        # One or more accepted issuers, None does not check iss
+        if isinstance(issuer, basestring):
+            issuer = (issuer,)
+        self.issuers = issuer
+        self.audience = audience
+        self.algorithms = algorithms
+        self.refresh_interval = refresh_interval
+        self.min_refresh_interval = min_refresh_interval
+        self.leeway = leeway
+        self.http = http
+        # kid -> public key
+        self.keys = {}
+        self.fetched = 0
+        self.lock = threading.Lock()
+        self.refresher_pid = None
+
+    def log(self, msg):
+        QgsMessageLog.logMessage('[OAUTH2] %s' % msg)
+
+    def refresh(self):
+        """Fetch the JWKS, keep the current keys on error"""
+        with self.lock:
+            if time() - self.fetched < self.min_refresh_interval:
+                return
+            self.fetched = time()
+        try:
+            response = self.http.get(self.jwks_url)
+            response.raise_for_status()
+            keys = {}
+            algorithms = get_default_algorithms()
+            for jwk in json.loads(response.text)['keys']:
+                algorithm = algorithms.get(jwk.get('alg', self.algorithms[0]))
+                if algorithm is None or jwk.get('use', 'sig') != 'sig':
+                    continue
+                keys[jwk.get('kid')] = algorithm.from_jwk(json.dumps(jwk))
+            self.keys = keys
+            self.log('JWKS refreshed from %s: %s keys' % (self.jwks_url, len(keys)))
+        except Exception, e:
+            self.log('Cannot refresh JWKS from %s: %s' % (self.jwks_url, e))
+
+    def _refresher(self):
+        while True:
+            sleep(self.refresh_interval)
+            self.refresh()
+
+    def _start_refresher(self):
+        """Start the refresher thread unless it is running in this process"""
+        if self.refresher_pid == os.getpid():
+            return
+        with self.lock:
+            if self.refresher_pid == os.getpid():
+                return
+            self.refresher_pid = os.getpid()
+        refresher = threading.Thread(target=self._refresher, name='oauth2-jwks')
+        refresher.daemon = True
+        refresher.start()
+
+    def get_key(self, kid):
+        self._start_refresher()
+        key = self.keys.get(kid)
+        if key is None:
+            # Unknown key: the provider might have rotated its keys
+            self.refresh()
+            key = self.keys.get(kid)
+        return key
+
+    def validate(self, token):
+        """
+        Return the claims of a valid JWT, False for an invalid JWT and
+        None if token is not a JWT or cannot be validated locally (no key
+        for it: JWKS unavailable or key rotated)
+        """
+        try:
+            header = jwt.get_unverified_header(token)
+        except jwt.InvalidTokenError:
+            return None
+        if header.get('alg') not in self.algorithms:
+            return False
+        key = self.get_key(header.get('kid'))
+        if key is None:
+            self.log('No JWKS key for kid %s' % header.get('kid'))
+            return None
+        try:
+            claims = jwt.decode(token, key, algorithms=self.algorithms,
+                                audience=self.audience, leeway=self.leeway)
+        except jwt.InvalidTokenError, e:
+            self.log('Invalid JWT: %s' % e)
+            return False
+        if 'exp' not in claims:
+            return False
+        if self.issuers and claims.get('iss') not in self.issuers:
+            self.log('Invalid JWT issuer: %s' % claims.get('iss'))
+            return False
+        return claims
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+"""
+QGIS Server OAuth 2 encrypted session cookie
+
+.. note:: This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+"""
+
+__author__ = 'agent'
+__date__ = '10/18/2026'
+# This will get replaced with a git SHA1 when you do a git archive
+__revision__ = '$Format:%H$'
+
+import json
+import base64
+import hashlib
+from time import time
+from Cookie import SimpleCookie, CookieError
+
+# Optional: only needed when OAUTH2_SESSION_COOKIE is on
+try:
+    from cryptography.fernet import Fernet, InvalidToken
+except ImportError:
+    Fernet = None
+
+from oauth_settings import *
+
+
+class SessionCookie(object):
+    """
+    Authenticated and encrypted (Fernet) cookie carrying the access_token,
+    the identity and the expiry of a verified session: it is validated
+    without any storage I/O.
+    """
+
+    def __init__(self, secret=OAUTH2_SESSION_COOKIE_SECRET,
+                 name=OAUTH2_SESSION_COOKIE_NAME,
+                 max_age=OAUTH2_SESSION_COOKIE_TTL):
+        if Fernet is None:
+            raise Exception("Please install the required Python packages for session cookies (cryptography)")
+        if not secret:
+            raise Exception('Configuration error: OAUTH2_SESSION_COOKIE_SECRET is not set!')
+        self.fernet = Fernet(base64.urlsafe_b64encode(hashlib.sha256(secret).digest()))
+        self.name = name
+        self.max_age = max_age
+
+    def dumps(self, access_token, expire, subject=None):
+        """Return the cookie value"""
+        return self.fernet.encrypt(json.dumps({'t': access_token,
+                                               'exp': int(expire),
+                                               'sub': subject}))
+
+    def loads(self, value):
+        """Return the session dict of a valid cookie value, None otherwise"""
+        try:
+            session = json.loads(self.fernet.decrypt(str(value)))
+        except (InvalidToken, ValueError, TypeError):
+            return None
+        if session.get('exp', 0) <= time():
+            return None
+        return session
+
+    def from_header(self, cookie_header):
+        """Return the session dict from a Cookie request header, None if missing or invalid"""
+        if not cookie_header or self.name not in cookie_header:
+            return None
+        try:
+            morsel = SimpleCookie(str(cookie_header)).get(self.name)
+        except CookieError:
+            return None
+        if morsel is None:
+            return None
+        return self.loads(morsel.value)
+
+    def header(self, access_token, token_timeout, subject=None, secure=False):
+        """Return the Set-Cookie header value for a verified access_token"""
+        max_age = int(min(self.max_age, token_timeout))
+        value = self.dumps(access_token, time() + max_age, subject)
+        return '%s=%s; Max-Age=%d; Path=/; HttpOnly;%s SameSite=Lax' % (
+            self.name, value, max_age, ' Secure;' if secure else '')
@@ -9,6 +9,12 @@ try:
 except ImportError:
     raise Exception("Please install the required Python packages in REQUIREMENTS.txt")
 
+
+def _env_bool(name):
+    """True if the environment variable name is set to 1, true, yes or on"""
+    return os.environ.get(name, '').lower() in ('1', 'true', 'yes', 'on')
+
+
 # Authorization Service Provider (a suitable class must exist in filters)
 # default to Twitter
 OAUTH2_AUTHORIZATION_SERVICE_PROVIDER = os.environ.get('OAUTH2_AUTHORIZATION_SERVICE_PROVIDER', 'twitter')
@@ -21,3 +27,117 @@ OAUTH2_ACCESS_TOKEN_URL = os.environ.get('OAUTH2_ACCESS_TOKEN_URL')
 OAUTH2_SCOPE = os.environ.get('OAUTH2_SCOPE')
 # This is optional and provider-dependant
 OAUTH2_VERIFY_URL = os.environ.get('OAUTH2_VERIFY_URL', False)
+
+# Secret of the keyed digests stored in place of the tokens (all the
+# processes and nodes sharing a storage must use the same secret)
+OAUTH2_STORAGE_KEY_SECRET = os.environ.get('OAUTH2_STORAGE_KEY_SECRET', OAUTH2_CLIENT_SECRET or '')
+# Number of SQLite databases (shards) used by the token and request storages
+OAUTH2_STORAGE_SHARDS = int(os.environ.get('OAUTH2_STORAGE_SHARDS', 1))
+# Maximum number of idle SQLite connections kept open for each shard
+OAUTH2_STORAGE_POOL_SIZE = int(os.environ.get('OAUTH2_STORAGE_POOL_SIZE', 4))
+# Idle SQLite connections are closed after this number of seconds
+OAUTH2_STORAGE_POOL_IDLE_TIMEOUT = float(os.environ.get('OAUTH2_STORAGE_POOL_IDLE_TIMEOUT', 300))
+# Seconds between two background sweeps of the expired entries (0 disables)
+OAUTH2_STORAGE_SWEEP_INTERVAL = float(os.environ.get('OAUTH2_STORAGE_SWEEP_INTERVAL', 60))
+# Maximum number of entries deleted by a single sweep transaction
+OAUTH2_STORAGE_SWEEP_BATCH = int(os.environ.get('OAUTH2_STORAGE_SWEEP_BATCH', 500))
+# Optional size bounds for each storage (0 means unbounded)
+OAUTH2_STORAGE_MAX_ENTRIES = int(os.environ.get('OAUTH2_STORAGE_MAX_ENTRIES', 0))
+OAUTH2_STORAGE_MAX_BYTES = int(os.environ.get('OAUTH2_STORAGE_MAX_BYTES', 0))
+# In-process L1 cache in front of the token storage: maximum number of
+# tokens (0 disables) and number of seconds a token may be served from it
+OAUTH2_L1_CACHE_SIZE = int(os.environ.get('OAUTH2_L1_CACHE_SIZE', 1000))
+OAUTH2_L1_CACHE_TTL = float(os.environ.get('OAUTH2_L1_CACHE_TTL', 5))
+# Negative cache for the tokens that failed verification: maximum number
+# of tokens (0 disables) and number of seconds they are rejected without
+# calling the verify endpoint
+OAUTH2_NEGATIVE_CACHE_SIZE = int(os.environ.get('OAUTH2_NEGATIVE_CACHE_SIZE', 1000))
+OAUTH2_NEGATIVE_CACHE_TTL = float(os.environ.get('OAUTH2_NEGATIVE_CACHE_TTL', 10))
+# Pooled HTTP client for the provider endpoints: number of keep-alive
+# connections for each host, connect and read timeouts in seconds, number
+# of retries on connection errors and 502/503/504 and retry backoff factor
+OAUTH2_HTTP_POOL_SIZE = int(os.environ.get('OAUTH2_HTTP_POOL_SIZE', 10))
+OAUTH2_HTTP_CONNECT_TIMEOUT = float(os.environ.get('OAUTH2_HTTP_CONNECT_TIMEOUT', 3.05))
+OAUTH2_HTTP_READ_TIMEOUT = float(os.environ.get('OAUTH2_HTTP_READ_TIMEOUT', 10))
+OAUTH2_HTTP_RETRIES = int(os.environ.get('OAUTH2_HTTP_RETRIES', 2))
+OAUTH2_HTTP_BACKOFF = float(os.environ.get('OAUTH2_HTTP_BACKOFF', 0.1))
+# Concurrent verifications of the same token are coalesced in one call to
+# the provider: lifetime of the shared lease, that is the maximum number of
+# seconds to wait for the result of another request or process, and polling
+# interval of the lease. The lease must outlive the slowest verify call (all
+# the attempts timing out, with their backoff), or another process would
+# call the provider again.
+OAUTH2_VERIFY_LEASE_TIMEOUT = float(os.environ.get(
+    'OAUTH2_VERIFY_LEASE_TIMEOUT',
+    (OAUTH2_HTTP_CONNECT_TIMEOUT + OAUTH2_HTTP_READ_TIMEOUT) * (OAUTH2_HTTP_RETRIES + 1)
+    + OAUTH2_HTTP_BACKOFF * 2 ** OAUTH2_HTTP_RETRIES + 1))
+OAUTH2_VERIFY_LEASE_POLL = float(os.environ.get('OAUTH2_VERIFY_LEASE_POLL', 0.05))
+# Local validation of JWT access tokens against the provider JWKS
+OAUTH2_JWT_VERIFY = _env_bool('OAUTH2_JWT_VERIFY')
+OAUTH2_JWKS_URL = os.environ.get('OAUTH2_JWKS_URL')
+# Comma separated list of accepted issuers
+OAUTH2_JWT_ISSUER = tuple(i for i in os.environ.get('OAUTH2_JWT_ISSUER', '').split(',') if i) or None
+# Expected audience, defaults to the client ID
+OAUTH2_JWT_AUDIENCE = os.environ.get('OAUTH2_JWT_AUDIENCE', OAUTH2_CLIENT_ID)
+OAUTH2_JWT_ALGORITHMS = os.environ.get('OAUTH2_JWT_ALGORITHMS', 'RS256').split(',')
+# Seconds of clock skew tolerated on exp
+OAUTH2_JWT_LEEWAY = float(os.environ.get('OAUTH2_JWT_LEEWAY', 30))
+# Seconds between two background refreshes of the JWKS and minimum seconds
+# between two refreshes triggered by unknown keys
+OAUTH2_JWKS_REFRESH_INTERVAL = float(os.environ.get('OAUTH2_JWKS_REFRESH_INTERVAL', 3600))
+OAUTH2_JWKS_MIN_REFRESH_INTERVAL = float(os.environ.get('OAUTH2_JWKS_MIN_REFRESH_INTERVAL', 60))
+# Cache TTL of the tokens: derived from expires_in or exp (capped by the
+# max) when the provider returns them, the default otherwise (bounded by the
+# min and max), shortened by a random fraction up to the jitter
+OAUTH2_TOKEN_TTL_DEFAULT = float(os.environ.get('OAUTH2_TOKEN_TTL_DEFAULT', 3600))
+OAUTH2_TOKEN_TTL_MIN = float(os.environ.get('OAUTH2_TOKEN_TTL_MIN', 30))
+OAUTH2_TOKEN_TTL_MAX = float(os.environ.get('OAUTH2_TOKEN_TTL_MAX', 86400))
+OAUTH2_TOKEN_TTL_JITTER = float(os.environ.get('OAUTH2_TOKEN_TTL_JITTER', 0.1))
+# Background refresh of the tokens in use: tokens expiring within this
+# number of seconds are refreshed or re-verified (0 disables), seconds
+# between two checks, seconds after which an unused token is not refreshed
+# anymore and number of refresh worker threads
+OAUTH2_REFRESH_AHEAD = float(os.environ.get('OAUTH2_REFRESH_AHEAD', 300))
+OAUTH2_REFRESH_INTERVAL = float(os.environ.get('OAUTH2_REFRESH_INTERVAL', 30))
+OAUTH2_REFRESH_IDLE = float(os.environ.get('OAUTH2_REFRESH_IDLE', 900))
+OAUTH2_REFRESH_WORKERS = int(os.environ.get('OAUTH2_REFRESH_WORKERS', 2))
+# Opt-in: keep accepting the access token of the client after its expiry,
+# for as long as its refresh_token can be exchanged for a new token
+OAUTH2_REFRESH_EXTEND_TOKENS = _env_bool('OAUTH2_REFRESH_EXTEND_TOKENS')
+# Circuit breaker of each provider endpoint: it opens after this number of
+# consecutive errors or calls slower than the slow call seconds (0 only
+# counts errors) and lets a trial call through after the reset timeout
+OAUTH2_BREAKER_FAILURES = int(os.environ.get('OAUTH2_BREAKER_FAILURES', 5))
+OAUTH2_BREAKER_SLOW_CALL = float(os.environ.get('OAUTH2_BREAKER_SLOW_CALL', 5))
+OAUTH2_BREAKER_RESET_TIMEOUT = float(os.environ.get('OAUTH2_BREAKER_RESET_TIMEOUT', 30))
+# Maximum seconds a request waits for the verification of its token and
+# number of verification threads in each process
+OAUTH2_AUTH_BUDGET = float(os.environ.get('OAUTH2_AUTH_BUDGET', 5))
+OAUTH2_VERIFY_WORKERS = int(os.environ.get('OAUTH2_VERIFY_WORKERS', 4))
+# Seconds an expired token is still accepted while it is verified again in
+# the background (stale-while-revalidate, 0 disables)
+OAUTH2_STALE_GRACE = float(os.environ.get('OAUTH2_STALE_GRACE', 0))
+# Login state: seconds a login can take, stateless HMAC-signed state
+# (no server-side storage, works across nodes) and its signing secret
+OAUTH2_STATE_TTL = float(os.environ.get('OAUTH2_STATE_TTL', 600))
+OAUTH2_STATELESS_STATE = _env_bool('OAUTH2_STATELESS_STATE')
+OAUTH2_STATE_SECRET = os.environ.get('OAUTH2_STATE_SECRET', OAUTH2_CLIENT_SECRET or '')
+# Encrypted session cookie: requests carrying a valid cookie are authorized
+# without storage I/O; cookie name, encryption secret and maximum lifetime
+OAUTH2_SESSION_COOKIE = _env_bool('OAUTH2_SESSION_COOKIE')
+OAUTH2_SESSION_COOKIE_NAME = os.environ.get('OAUTH2_SESSION_COOKIE_NAME', 'qgis_oauth2_session')
+OAUTH2_SESSION_COOKIE_SECRET = os.environ.get('OAUTH2_SESSION_COOKIE_SECRET', OAUTH2_CLIENT_SECRET or '')
+OAUTH2_SESSION_COOKIE_TTL = float(os.environ.get('OAUTH2_SESSION_COOKIE_TTL', 3600))
+# Storage backend for tokens, requests and leases: sqlite (host-local) or
+# redis (shared by all the nodes), Redis server URL and connection pool size
+OAUTH2_STORAGE_BACKEND = os.environ.get('OAUTH2_STORAGE_BACKEND', 'sqlite').lower()
+OAUTH2_REDIS_URL = os.environ.get('OAUTH2_REDIS_URL', 'redis://localhost:6379/0')
+OAUTH2_REDIS_POOL_SIZE = int(os.environ.get('OAUTH2_REDIS_POOL_SIZE', 10))
+# Host-local token table in shared memory, seen by all the worker processes
+# (it replaces the in-process L1 cache): number of slots (0 disables), file
+# path, maximum size of a cached value and seconds a token may be served
+# from it without checking the storage
+OAUTH2_SHM_SLOTS = int(os.environ.get('OAUTH2_SHM_SLOTS', 0))
+OAUTH2_SHM_PATH = os.environ.get('OAUTH2_SHM_PATH', '/dev/shm/outh2_token_table' if os.path.isdir('/dev/shm') else '/tmp/outh2_token_table')
+OAUTH2_SHM_VALUE_SIZE = int(os.environ.get('OAUTH2_SHM_VALUE_SIZE', 256))
+OAUTH2_SHM_TTL = float(os.environ.get('OAUTH2_SHM_TTL', 60))
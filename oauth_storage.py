@@ -0,0 +1,952 @@
+# -*- coding: utf-8 -*-
+"""
+QGIS Server OAuth 2 token and request storage backends
+
+.. note:: This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+"""
+
+__author__ = 'agent'
+__date__ = '10/18/2026'
+# This will get replaced with a git SHA1 when you do a git archive
+__revision__ = '$Format:%H$'
+
+import os
+import re
+import errno
+import sqlite3
+import hmac
+import mmap
+import struct
+import hashlib
+import threading
+from time import time, sleep
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from cPickle import loads, dumps
+
+from qgis.core import QgsMessageLog
+from werkzeug.contrib.cache import BaseCache
+
+# Not available on Windows: only needed when OAUTH2_SHM_SLOTS is set
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Optional: only needed when OAUTH2_STORAGE_BACKEND is redis
+try:
+    import redis
+except ImportError:
+    redis = None
+
+from oauth_settings import *
+
+# Keyed hash of the storage keys, copied for each key
+_key_hmac = hmac.new(OAUTH2_STORAGE_KEY_SECRET, digestmod=hashlib.sha256)
+
+
+def key_digest(key):
+    """
+    Return the fixed width (16 bytes) keyed digest stored in place of key:
+    tokens are not stored in clear
+    """
+    digest = _key_hmac.copy()
+    digest.update(str(key))
+    return digest.digest()[:16]
+
+
+class DictCache(BaseCache):
+    """BaseCache with the dict protocol used by the filters"""
+
+    def __delitem__(self, key):
+        key = str(key)
+        self.delete(key)
+
+    def __getitem__(self, key):
+        val = self.get(key)
+        if val is None:
+            raise KeyError
+        return val
+
+    def __setitem__(self, key, value):
+        return self.set(key, value)
+
+
+class PickleSerializer(object):
+    """Serialize any picklable value"""
+
+    @staticmethod
+    def dumps(value):
+        return dumps(value, 2)
+
+    @staticmethod
+    def loads(data):
+        return loads(data)
+
+
+# Provider tags of the token records, append only: the index is stored
+_providers = ('', 'base', 'auth0', 'github', 'google', 'twitter')
+
+
+def _text(value):
+    if value is None:
+        return ''
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return str(value)
+
+
+def token_record(token_info, provider=OAUTH2_AUTHORIZATION_SERVICE_PROVIDER):
+    """
+    Return the token record of token_info (a provider response): a dict
+    with only the fields used by the filters, sub, exp (if known), scope,
+    provider and, with OAUTH2_REFRESH_EXTEND_TOKENS, refresh_token (if any).
+    Token records are returned as is.
+    """
+    if not isinstance(token_info, dict):
+        token_info = {}
+    subject = None
+    for name in ('sub', 'email', 'login', 'user_id', 'screen_name', 'id'):
+        subject = token_info.get(name)
+        if subject:
+            break
+    expire = token_info.get('exp')
+    if expire is None and token_info.get('expires_in') is not None:
+        expire = time() + float(token_info['expires_in'])
+    scope = token_info.get('scope')
+    if scope is None and isinstance(token_info.get('scp'), list):
+        scope = ' '.join(token_info['scp'])
+    record = {'sub': _text(subject),
+              'scope': _text(scope),
+              'provider': token_info.get('provider', provider)}
+    if expire is not None:
+        record['exp'] = float(expire)
+    # Long lived credential: only stored when it is used
+    if OAUTH2_REFRESH_EXTEND_TOKENS and token_info.get('refresh_token'):
+        record['refresh_token'] = _text(token_info['refresh_token'])
+    return record
+
+
+class TokenRecordSerializer(object):
+    """
+    Serialize token records (see token_record()) in a fixed binary
+    layout: version, provider tag, expiry and the lengths of subject,
+    scope and refresh_token, followed by the three strings.
+    """
+    _version = 1
+    # version, provider tag, expire (0 if unknown), subject, scope and
+    # refresh_token lengths
+    _header = struct.Struct('<BBdHHH')
+
+    def dumps(self, value):
+        record = token_record(value)
+        subject = record['sub']
+        scope = record['scope']
+        refresh_token = record.get('refresh_token', '')
+        try:
+            tag = _providers.index(record['provider'])
+        except ValueError:
+            tag = 0
+        return self._header.pack(self._version, tag, record.get('exp', 0),
+                                 len(subject), len(scope),
+                                 len(refresh_token)) + subject + scope + refresh_token
+
+    def loads(self, data):
+        version, tag, expire, subject_len, scope_len, refresh_len = \
+            self._header.unpack_from(data)
+        if version != self._version:
+            raise ValueError('Unknown token record version %s' % version)
+        start = self._header.size
+        end = start + subject_len
+        record = {'sub': data[start:end],
+                  'scope': data[end:end + scope_len],
+                  'provider': _providers[tag] if tag < len(_providers) else ''}
+        if expire:
+            record['exp'] = expire
+        if refresh_len:
+            end += scope_len
+            record['refresh_token'] = data[end:end + refresh_len]
+        return record
+
+
+class SqliteCache(DictCache):
+    """
+    SQLite backed cache: all keys live in a small fixed number of WAL-mode
+    databases (shards). Keys are stored as their key_digest(), the shard
+    is chosen from the digest.
+    """
+    _create_sql = (
+            'CREATE TABLE IF NOT EXISTS bucket '
+            '('
+            '  key BLOB PRIMARY KEY,'
+            '  val BLOB,'
+            '  exp FLOAT'
+            ')'
+            )
+    _create_index_sql = 'CREATE INDEX IF NOT EXISTS bucket_exp ON bucket (exp)'
+    _get_sql = 'SELECT val, exp FROM bucket WHERE key = ?'
+    _get_many_sql = 'SELECT key, val, exp FROM bucket WHERE key IN (%s)'
+    # Maximum number of keys in a get_many() query (SQLite allows 999
+    # parameters by default)
+    _many_batch = 500
+    _del_sql = 'DELETE FROM bucket WHERE key = ?'
+    _set_sql = 'REPLACE INTO bucket (key, val, exp) VALUES (?, ?, ?)'
+    _add_sql = 'INSERT INTO bucket (key, val, exp) VALUES (?, ?, ?)'
+    _del_expired_sql = 'DELETE FROM bucket WHERE key = ? AND exp <= ?'
+    _clear_sql = 'DELETE FROM bucket'
+    # Expiry and eviction, both walk the exp index
+    _sweep_sql = ('DELETE FROM bucket WHERE rowid IN '
+                  '(SELECT rowid FROM bucket WHERE exp <= ? LIMIT ?)')
+    _evict_sql = ('DELETE FROM bucket WHERE rowid IN '
+                  '(SELECT rowid FROM bucket ORDER BY exp LIMIT ?)')
+    _count_sql = 'SELECT COUNT(*) FROM bucket'
+    _size_sql = 'SELECT TOTAL(LENGTH(key) + LENGTH(val)) FROM bucket'
+    _sizes_sql = 'SELECT rowid, LENGTH(key) + LENGTH(val) FROM bucket ORDER BY exp'
+    _del_rowid_sql = 'DELETE FROM bucket WHERE rowid = ?'
+    _shard_name = 'shard_%d.sqlite'
+    # Shard databases and their WAL files, anything else in the storage
+    # folder is left over by the one database per key layout
+    _shard_re = re.compile(r'^shard_\d+\.sqlite(-wal|-shm)?$')
+    _shard_struct = struct.Struct('<I')
+    # Size of the per connection prepared statements cache
+    _cached_statements = 32
+
+    def __init__(self, path, default_timeout=3600, shards=OAUTH2_STORAGE_SHARDS,
+                 pool_size=OAUTH2_STORAGE_POOL_SIZE,
+                 pool_idle_timeout=OAUTH2_STORAGE_POOL_IDLE_TIMEOUT,
+                 sweep_interval=OAUTH2_STORAGE_SWEEP_INTERVAL,
+                 sweep_batch=OAUTH2_STORAGE_SWEEP_BATCH,
+                 max_entries=OAUTH2_STORAGE_MAX_ENTRIES,
+                 max_bytes=OAUTH2_STORAGE_MAX_BYTES, stale_grace=0,
+                 serializer=PickleSerializer()):
+        self.path = os.path.abspath(path)
+        # The entries are credentials: only the server user can read them
+        try:
+            os.mkdir(self.path, 0700)
+        except OSError, e:
+            if e.errno != errno.EEXIST or not os.path.isdir(self.path):
+                raise
+            if os.stat(self.path).st_uid == os.geteuid():
+                os.chmod(self.path, 0700)
+        self.default_timeout = default_timeout
+        self.shards = max(1, int(shards))
+        # Idle connections: shard -> list of (last_used, connection)
+        self.pool_size = pool_size
+        self.pool_idle_timeout = pool_idle_timeout
+        self.pool = dict((shard, []) for shard in range(self.shards))
+        self.pool_pid = os.getpid()
+        self.pool_lock = threading.Lock()
+        self.pool_stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+        # Background sweeper, started by the first write in each process
+        self.sweep_interval = sweep_interval
+        self.sweep_batch = max(1, int(sweep_batch))
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sweeper_pid = None
+        # Expired entries are kept (and returned by get_stale()) for
+        # stale_grace seconds
+        self.stale_grace = stale_grace
+        self.serializer = serializer
+
+    def _get_shard(self, key):
+        """Stable (across processes) shard number for the digest of a key"""
+        return self._shard_struct.unpack_from(key)[0] % self.shards
+
+    def _connect(self, shard):
+        shard_path = os.path.join(self.path, self._shard_name % shard)
+        # SQLite creates the WAL files with the mode of the database
+        os.close(os.open(shard_path, os.O_RDWR | os.O_CREAT, 0600))
+        # Connections are handed over between threads by the pool, but
+        # never used by two threads at the same time
+        conn = sqlite3.Connection(shard_path, timeout=60,
+                                  check_same_thread=False,
+                                  cached_statements=self._cached_statements)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        with conn:
+            conn.execute(self._create_sql)
+            conn.execute(self._create_index_sql)
+        return conn
+
+    def _checkout(self, shard):
+        with self.pool_lock:
+            if self.pool_pid != os.getpid():
+                # Never use the connections opened before a fork
+                self.pool = dict((shard, []) for shard in range(self.shards))
+                self.pool_pid = os.getpid()
+            idle = self.pool[shard]
+            if idle:
+                self.pool_stats['hits'] += 1
+                return idle.pop()[1]
+            self.pool_stats['misses'] += 1
+        return self._connect(shard)
+
+    def _checkin(self, shard, conn):
+        now = time()
+        expired = []
+        with self.pool_lock:
+            idle = self.pool[shard]
+            # Oldest connections are at the start of the list
+            while idle and now - idle[0][0] > self.pool_idle_timeout:
+                expired.append(idle.pop(0)[1])
+            if len(idle) < self.pool_size:
+                idle.append((now, conn))
+            else:
+                expired.append(conn)
+            self.pool_stats['evictions'] += len(expired)
+        for conn in expired:
+            conn.close()
+
+    @contextmanager
+    def _get_shard_conn(self, shard):
+        """Borrow a connection from the pool, run a transaction on it"""
+        conn = self._checkout(shard)
+        try:
+            with conn:
+                yield conn
+        finally:
+            self._checkin(shard, conn)
+
+    def _get_conn(self, key):
+        return self._get_shard_conn(self._get_shard(key))
+
+    def close(self):
+        """Close all the idle connections"""
+        with self.pool_lock:
+            idle = [conn for shard in self.pool.values() for _, conn in shard]
+            for shard in self.pool.values():
+                del shard[:]
+        for conn in idle:
+            conn.close()
+
+    def _get_row(self, key, grace=0):
+        key = buffer(key_digest(key))
+        rv = (None, None)
+        with self._get_conn(key) as conn:
+            for row in conn.execute(self._get_sql, (key,)):
+                expire = row[1]
+                if expire > time() - grace:
+                    rv = (self.serializer.loads(str(row[0])), expire)
+                break
+        return rv
+
+    def get_with_expiry(self, key):
+        """Return the (value, expire) tuple, (None, None) on miss"""
+        return self._get_row(key)
+
+    def get_stale(self, key):
+        """Same as get_with_expiry() but also return entries expired for less than stale_grace"""
+        return self._get_row(key, self.stale_grace)
+
+    def get(self, key):
+        return self.get_with_expiry(key)[0]
+
+    def delete(self, key):
+        key = buffer(key_digest(key))
+        with self._get_conn(key) as conn:
+            conn.execute(self._del_sql, (key,))
+
+    def set(self, key, value, timeout=None):
+        key = buffer(key_digest(key))
+        if not timeout:
+            timeout = self.default_timeout
+        value = buffer(self.serializer.dumps(value))
+        expire = time() + timeout
+        self._start_sweeper()
+        with self._get_conn(key) as conn:
+            conn.execute(self._set_sql, (key, value, expire))
+
+    def add(self, key, value, timeout=None):
+        key = buffer(key_digest(key))
+        if not timeout:
+            timeout = self.default_timeout
+        expire = time() + timeout
+        value = buffer(self.serializer.dumps(value))
+        self._start_sweeper()
+        with self._get_conn(key) as conn:
+            # An expired entry does not prevent adding the key
+            conn.execute(self._del_expired_sql, (key, time()))
+            try:
+                conn.execute(self._add_sql, (key, value, expire))
+            except sqlite3.IntegrityError:
+                return False
+        return True
+
+    def _group_by_shard(self, keys):
+        """Return shard -> list of the digests of keys in that shard"""
+        shards = {}
+        for key in keys:
+            key = buffer(key_digest(key))
+            shards.setdefault(self._get_shard(key), []).append(key)
+        return shards
+
+    def get_many(self, *keys):
+        """Return the values of keys, one SELECT ... IN per shard and batch"""
+        values = {}
+        now = time()
+        for shard, digests in self._group_by_shard(keys).items():
+            with self._get_shard_conn(shard) as conn:
+                for start in xrange(0, len(digests), self._many_batch):
+                    batch = digests[start:start + self._many_batch]
+                    sql = self._get_many_sql % ','.join('?' * len(batch))
+                    for key, value, expire in conn.execute(sql, batch):
+                        if expire > now:
+                            values[str(key)] = self.serializer.loads(str(value))
+        return [values.get(key_digest(key)) for key in keys]
+
+    def set_many(self, mapping, timeout=None):
+        """Set all the keys of mapping, in one transaction per shard"""
+        if not timeout:
+            timeout = self.default_timeout
+        expire = time() + timeout
+        rows = {}
+        for key, value in mapping.items():
+            key = buffer(key_digest(key))
+            rows.setdefault(self._get_shard(key), []).append(
+                (key, buffer(self.serializer.dumps(value)), expire))
+        self._start_sweeper()
+        for shard, shard_rows in rows.items():
+            with self._get_shard_conn(shard) as conn:
+                conn.executemany(self._set_sql, shard_rows)
+        return True
+
+    def delete_many(self, *keys):
+        """Delete keys, in one transaction per shard"""
+        for shard, digests in self._group_by_shard(keys).items():
+            with self._get_shard_conn(shard) as conn:
+                conn.executemany(self._del_sql, [(key,) for key in digests])
+        return True
+
+    def clear(self):
+        for shard in range(self.shards):
+            with self._get_shard_conn(shard) as conn:
+                conn.execute(self._clear_sql)
+        self.remove_legacy_files()
+
+    def remove_legacy_files(self):
+        """Delete the per key databases of previous versions, return their number"""
+        removed = 0
+        for name in os.listdir(self.path):
+            path = os.path.join(self.path, name)
+            if self._shard_re.match(name) or not os.path.isfile(path):
+                continue
+            try:
+                os.unlink(path)
+                removed += 1
+            except OSError, e:
+                if e.errno != errno.ENOENT:
+                    raise
+        return removed
+
+    def _delete_batches(self, shard, sql, params, count=None):
+        """
+        Run a batched DELETE statement (the last parameter is the batch size)
+        until it deletes less than a batch or count rows have been deleted,
+        each batch in its own transaction not to block the writers
+        """
+        deleted = 0
+        while count is None or deleted < count:
+            batch = self.sweep_batch
+            if count is not None:
+                batch = min(batch, count - deleted)
+            with self._get_shard_conn(shard) as conn:
+                rows = conn.execute(sql, params + (batch,)).rowcount
+            deleted += rows
+            if rows < batch:
+                break
+        return deleted
+
+    def _evict_bytes(self, shard, max_bytes):
+        """Delete the entries closest to expiry until shard is under max_bytes"""
+        with self._get_shard_conn(shard) as conn:
+            excess = conn.execute(self._size_sql).fetchone()[0] - max_bytes
+            if excess <= 0:
+                return 0
+            rowids = []
+            for rowid, size in conn.execute(self._sizes_sql):
+                rowids.append((rowid,))
+                excess -= size or 0
+                if excess <= 0:
+                    break
+        for i in range(0, len(rowids), self.sweep_batch):
+            with self._get_shard_conn(shard) as conn:
+                conn.executemany(self._del_rowid_sql,
+                                 rowids[i:i + self.sweep_batch])
+        return len(rowids)
+
+    def sweep(self):
+        """
+        Delete the expired entries and, if the storage is size bounded,
+        the entries closest to expiry. Return the number of deleted entries.
+        """
+        deleted = 0
+        for shard in range(self.shards):
+            deleted += self._delete_batches(shard, self._sweep_sql,
+                                            (time() - self.stale_grace,))
+            if self.max_entries:
+                with self._get_shard_conn(shard) as conn:
+                    count = conn.execute(self._count_sql).fetchone()[0]
+                excess = count - max(1, self.max_entries // self.shards)
+                if excess > 0:
+                    deleted += self._delete_batches(shard, self._evict_sql, (),
+                                                    excess)
+            if self.max_bytes:
+                deleted += self._evict_bytes(shard, max(1, self.max_bytes // self.shards))
+        return deleted
+
+    def _sweeper(self):
+        while True:
+            sleep(self.sweep_interval)
+            try:
+                self.sweep()
+            except Exception, e:
+                QgsMessageLog.logMessage('[OAUTH2] Storage sweep of %s failed: %s' % (self.path, e))
+
+    def _start_sweeper(self):
+        """Start the sweeper thread unless it is running in this process"""
+        if not self.sweep_interval or self.sweeper_pid == os.getpid():
+            return
+        with self.pool_lock:
+            if self.sweeper_pid == os.getpid():
+                return
+            self.sweeper_pid = os.getpid()
+        sweeper = threading.Thread(target=self._sweeper, name='oauth2-sweeper')
+        sweeper.daemon = True
+        sweeper.start()
+
+
+class MemoryCache(DictCache):
+    """
+    In-process LRU cache with TTL, bounded to max_entries entries
+    """
+
+    def __init__(self, max_entries=1000, default_timeout=5):
+        self.max_entries = max_entries
+        self.default_timeout = default_timeout
+        # key -> (expire, value), least recently used first
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+    def get(self, key):
+        key = str(key)
+        with self.lock:
+            try:
+                expire, value = self.entries.pop(key)
+            except KeyError:
+                self.stats['misses'] += 1
+                return None
+            if expire <= time():
+                self.stats['misses'] += 1
+                return None
+            # Most recently used
+            self.entries[key] = (expire, value)
+            self.stats['hits'] += 1
+            return value
+
+    def delete(self, key):
+        key = str(key)
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def set(self, key, value, timeout=None):
+        key = str(key)
+        if not timeout:
+            timeout = self.default_timeout
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = (time() + timeout, value)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.stats['evictions'] += 1
+
+    def add(self, key, value, timeout=None):
+        key = str(key)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] > time():
+                return False
+        self.set(key, value, timeout)
+        return True
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+class TieredCache(DictCache):
+    """
+    Put an in-process MemoryCache (L1) in front of a shared storage (L2):
+    values are kept in L1 for at most cache.default_timeout seconds (the
+    staleness window) and never beyond their expiry in L2.
+    """
+
+    def __init__(self, storage, cache):
+        self.storage = storage
+        self.cache = cache
+        self.default_timeout = storage.default_timeout
+
+    @property
+    def stats(self):
+        return self.cache.stats
+
+    def get_with_expiry(self, key):
+        return self.storage.get_with_expiry(key)
+
+    def get_stale(self, key):
+        return self.storage.get_stale(key)
+
+    def _cache_timeout(self, timeout):
+        return min(self.cache.default_timeout, timeout)
+
+    def _normalized(self, value):
+        """
+        The value as read back from storage, set in both tiers so that
+        they return the same value
+        """
+        serializer = getattr(self.storage, 'serializer', None)
+        if serializer is None:
+            return value
+        return serializer.loads(serializer.dumps(value))
+
+    def get(self, key):
+        key = str(key)
+        value = self.cache.get(key)
+        if value is None:
+            value, expire = self.storage.get_with_expiry(key)
+            if value is not None:
+                timeout = self._cache_timeout(expire - time())
+                if timeout > 0:
+                    self.cache.set(key, value, timeout)
+        return value
+
+    def delete(self, key):
+        key = str(key)
+        self.storage.delete(key)
+        self.cache.delete(key)
+
+    def set(self, key, value, timeout=None):
+        key = str(key)
+        if not timeout:
+            timeout = self.default_timeout
+        value = self._normalized(value)
+        self.storage.set(key, value, timeout)
+        self.cache.set(key, value, self._cache_timeout(timeout))
+
+    def add(self, key, value, timeout=None):
+        key = str(key)
+        added = self.storage.add(key, value, timeout)
+        # L1 will be filled by get()
+        self.cache.delete(key)
+        return added
+
+    def get_many(self, *keys):
+        """L1 hits, then a single get_many() on storage for the misses"""
+        values = [self.cache.get(key) for key in keys]
+        missing = [key for key, value in zip(keys, values) if value is None]
+        if missing:
+            found = dict(zip(missing, self.storage.get_many(*missing)))
+            values = [found.get(key) if value is None else value
+                      for key, value in zip(keys, values)]
+        return values
+
+    def set_many(self, mapping, timeout=None):
+        if not timeout:
+            timeout = self.default_timeout
+        mapping = dict((key, self._normalized(value))
+                       for key, value in mapping.items())
+        self.storage.set_many(mapping, timeout)
+        for key, value in mapping.items():
+            self.cache.set(key, value, self._cache_timeout(timeout))
+        return True
+
+    def delete_many(self, *keys):
+        self.storage.delete_many(*keys)
+        for key in keys:
+            self.cache.delete(key)
+        return True
+
+    def clear(self):
+        self.storage.clear()
+        self.cache.clear()
+
+
+class RedisCache(DictCache):
+    """
+    Redis (or any Redis-protocol server) backed cache, shared by all the
+    nodes: the keys expire server-side, the connections are pooled and
+    the multiple keys operations are pipelined.
+    Values are stored with their expiry, the server-side TTL also covers
+    the stale_grace period.
+    """
+    _version = 1
+    # version, expire (followed by the serialized value)
+    _expire = struct.Struct('<Bd')
+
+    def __init__(self, prefix, default_timeout=3600, url=OAUTH2_REDIS_URL,
+                 pool_size=OAUTH2_REDIS_POOL_SIZE, stale_grace=0, client=None,
+                 serializer=PickleSerializer()):
+        if client is None:
+            if redis is None:
+                raise Exception("Please install the required Python packages for the Redis storage (redis)")
+            pool = redis.BlockingConnectionPool.from_url(url, max_connections=pool_size)
+            client = redis.StrictRedis(connection_pool=pool)
+        self.client = client
+        self.prefix = prefix
+        self.default_timeout = default_timeout
+        self.stale_grace = stale_grace
+        self.serializer = serializer
+
+    def _key(self, key):
+        return self.prefix + key_digest(key)
+
+    def _dumps(self, value, timeout):
+        if not timeout:
+            timeout = self.default_timeout
+        expire = time() + timeout
+        # Server-side TTL in milliseconds
+        ttl = max(1, int((timeout + self.stale_grace) * 1000))
+        return self._expire.pack(self._version, expire) + self.serializer.dumps(value), ttl
+
+    def _loads(self, data, grace=0):
+        if data is None:
+            return (None, None)
+        expire = self._expire.unpack_from(data)[1]
+        value = self.serializer.loads(data[self._expire.size:])
+        if expire > time() - grace:
+            return (value, expire)
+        return (None, None)
+
+    def get_with_expiry(self, key):
+        """Return the (value, expire) tuple, (None, None) on miss"""
+        return self._loads(self.client.get(self._key(key)))
+
+    def get_stale(self, key):
+        """Same as get_with_expiry() but also return entries expired for less than stale_grace"""
+        return self._loads(self.client.get(self._key(key)), self.stale_grace)
+
+    def get(self, key):
+        return self.get_with_expiry(key)[0]
+
+    def delete(self, key):
+        self.client.delete(self._key(key))
+
+    def set(self, key, value, timeout=None):
+        data, ttl = self._dumps(value, timeout)
+        self.client.set(self._key(key), data, px=ttl)
+
+    def add(self, key, value, timeout=None):
+        data, ttl = self._dumps(value, timeout)
+        return bool(self.client.set(self._key(key), data, px=ttl, nx=True))
+
+    def get_many(self, *keys):
+        pipe = self.client.pipeline(transaction=False)
+        for key in keys:
+            pipe.get(self._key(key))
+        return [self._loads(data)[0] for data in pipe.execute()]
+
+    def set_many(self, mapping, timeout=None):
+        pipe = self.client.pipeline(transaction=False)
+        for key, value in mapping.items():
+            data, ttl = self._dumps(value, timeout)
+            pipe.set(self._key(key), data, px=ttl)
+        pipe.execute()
+        return True
+
+    def delete_many(self, *keys):
+        if keys:
+            self.client.delete(*[self._key(key) for key in keys])
+        return True
+
+    def clear(self):
+        # Scan first: not all the Redis-protocol servers keep the SCAN
+        # cursor valid while the keys are deleted
+        keys = list(self.client.scan_iter(match=self.prefix + '*', count=500))
+        for i in range(0, len(keys), 500):
+            self.client.delete(*keys[i:i + 500])
+        return True
+
+
+class SharedMemoryCache(DictCache):
+    """
+    Host-local cache shared by all the worker processes: a fixed-size,
+    mmap-backed, open addressing hash table of key digest -> expiry and
+    serialized value. Reads are lock-free (a sequence number in each slot,
+    odd while the slot is written, detects concurrent writes), writers
+    hold a file lock. Values larger than value_size are not cached.
+    """
+    _magic = 'OA2T'
+    _version = 1
+    # magic, version, slots, value_size
+    _header = struct.Struct('<4sHII')
+    # sequence, key digest, expire, value length (followed by the value)
+    _meta = struct.Struct('<I16sdH')
+    _seq = struct.Struct('<I')
+    # Maximum number of slots looked up for a key
+    _probes = 8
+
+    def __init__(self, path=OAUTH2_SHM_PATH, slots=OAUTH2_SHM_SLOTS,
+                 value_size=OAUTH2_SHM_VALUE_SIZE,
+                 default_timeout=OAUTH2_SHM_TTL,
+                 serializer=PickleSerializer()):
+        if fcntl is None:
+            raise Exception('Configuration error: OAUTH2_SHM_SLOTS is not supported on this platform!')
+        # One file for each layout: the processes still running with
+        # another layout keep their own table
+        self.path = '%s.%d.%d' % (path, slots, value_size)
+        self.slots = slots
+        self.value_size = value_size
+        self.default_timeout = default_timeout
+        self.serializer = serializer
+        self.slot_size = self._meta.size + value_size
+        size = self._header.size + slots * self.slot_size
+        header = self._header.pack(self._magic, self._version, slots, value_size)
+        self.fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0600)
+        fcntl.flock(self.fd, fcntl.LOCK_EX)
+        try:
+            current_size = os.fstat(self.fd).st_size
+            if current_size == 0:
+                # New table
+                os.ftruncate(self.fd, size)
+                os.write(self.fd, header)
+                current_size = size
+            # Never resize a table mapped by other processes: they would
+            # crash (SIGBUS) reading past its end
+            os.lseek(self.fd, 0, os.SEEK_SET)
+            compatible = (current_size == size
+                          and os.read(self.fd, self._header.size) == header)
+            if compatible:
+                self.map = mmap.mmap(self.fd, size)
+        finally:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+        if not compatible:
+            os.close(self.fd)
+            msg = ('Configuration error: incompatible token table %s, '
+                   'delete it when no process uses it!' % self.path)
+            QgsMessageLog.logMessage('[OAUTH2] %s' % msg)
+            raise Exception(msg)
+        self.lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'oversize': 0}
+
+    def _offsets(self, key):
+        """Offsets of the slots where key can be, and its digest"""
+        digest = key_digest(key)
+        start = struct.unpack_from('<Q', digest)[0] % self.slots
+        for i in xrange(min(self._probes, self.slots)):
+            yield (self._header.size
+                   + ((start + i) % self.slots) * self.slot_size), digest
+
+    def _read(self, offset, digest):
+        """Return (expire, data) if the slot holds digest, None otherwise"""
+        # A writer killed in the middle of a write leaves the slot odd
+        for attempt in xrange(100):
+            seq, slot_digest, expire, length = self._meta.unpack_from(self.map, offset)
+            if slot_digest != digest:
+                return None
+            start = offset + self._meta.size
+            data = self.map[start:start + length]
+            if not seq & 1 and self._seq.unpack_from(self.map, offset)[0] == seq:
+                return expire, data
+        return None
+
+    def _write(self, offset, digest, expire, data):
+        """Write a slot (holding the writer locks)"""
+        seq = self._seq.unpack_from(self.map, offset)[0]
+        self._seq.pack_into(self.map, offset, (seq + 1) & 0xffffffff | 1)
+        start = offset + self._meta.size
+        self.map[start:start + len(data)] = data
+        self._meta.pack_into(self.map, offset, (seq + 1) & 0xffffffff | 1,
+                             digest, expire, len(data))
+        self._seq.pack_into(self.map, offset, (seq + 2) & 0xfffffffe)
+
+    @contextmanager
+    def _write_lock(self):
+        with self.lock:
+            fcntl.flock(self.fd, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(self.fd, fcntl.LOCK_UN)
+
+    def get_with_expiry(self, key):
+        """Return the (value, expire) tuple, (None, None) on miss"""
+        for offset, digest in self._offsets(key):
+            entry = self._read(offset, digest)
+            if entry is not None:
+                if entry[0] > time():
+                    self.stats['hits'] += 1
+                    return self.serializer.loads(entry[1]), entry[0]
+                break
+        self.stats['misses'] += 1
+        return (None, None)
+
+    def get(self, key):
+        return self.get_with_expiry(key)[0]
+
+    def delete(self, key):
+        with self._write_lock():
+            for offset, digest in self._offsets(key):
+                if self._meta.unpack_from(self.map, offset)[1] == digest:
+                    self._write(offset, digest, 0, '')
+
+    def set(self, key, value, timeout=None):
+        if not timeout:
+            timeout = self.default_timeout
+        data = self.serializer.dumps(value)
+        if len(data) > self.value_size:
+            self.stats['oversize'] += 1
+            self.delete(key)
+            return
+        now = time()
+        with self._write_lock():
+            target = None
+            for offset, digest in self._offsets(key):
+                slot_digest, expire = self._meta.unpack_from(self.map, offset)[1:3]
+                if slot_digest == digest:
+                    target = offset
+                    break
+                # Free slot or the one closest to expiry
+                if target is None or expire < target_expire:
+                    target, target_expire = offset, expire
+            else:
+                if target_expire > now:
+                    self.stats['evictions'] += 1
+            self._write(target, digest, now + timeout, data)
+
+    def add(self, key, value, timeout=None):
+        if self.get(key) is not None:
+            return False
+        self.set(key, value, timeout)
+        return True
+
+    def clear(self):
+        with self._write_lock():
+            for index in xrange(self.slots):
+                offset = self._header.size + index * self.slot_size
+                self._write(offset, '\0' * 16, 0, '')
+
+
+def make_storage(name, **kwargs):
+    """Return the storage name for the configured OAUTH2_STORAGE_BACKEND"""
+    if OAUTH2_STORAGE_BACKEND == 'redis':
+        return RedisCache('oauth2:%s:' % name, **kwargs)
+    if OAUTH2_STORAGE_BACKEND != 'sqlite':
+        raise Exception('Configuration error: unknown OAUTH2_STORAGE_BACKEND %s' % OAUTH2_STORAGE_BACKEND)
+    return SqliteCache('/tmp/outh2_%s_storage' % name, **kwargs)
+
+
+def token_cache(storage):
+    """
+    Wrap storage in the host-local shared memory cache or in the
+    in-process L1 cache, when they are enabled
+    """
+    if OAUTH2_SHM_SLOTS > 0:
+        return TieredCache(storage, SharedMemoryCache(serializer=storage.serializer))
+    if OAUTH2_L1_CACHE_SIZE > 0:
+        return TieredCache(storage, MemoryCache(OAUTH2_L1_CACHE_SIZE,
+                                                OAUTH2_L1_CACHE_TTL))
+    return storage
@@ -9,6 +9,14 @@ var OAUTH2_AUTHORIZATION_SERVICE_PROVIDER
 This script launches a QGIS Server listening on port 8081 or on the port
 specified on the environment variable QGIS_SERVER_DEFAULT_PORT
 
+With QGIS_SERVER_WORKERS set, the requests are served by that number of
+pre-forked worker processes sharing the listening socket, each with its own
+QgsServer: SIGHUP gracefully replaces the workers, SIGTERM stops them.
+
+With QGIS_SERVER_AUTH_GATEWAY set, the OAuth 2 filter runs on each request
+before QgsServer: logins, redirects and errors are answered without
+entering QgsServer.
+
 
 .. note:: This program is free software; you can redistribute it and/or modify
 it under the terms of the GNU General Public License as published by
@@ -27,10 +35,19 @@ __revision__ = '$Format:%H$'
 
 
 import os
+import errno
+import signal
+import threading
+import time
+import importlib
+import queue
+import re
 import urllib.parse
 from http.server import BaseHTTPRequestHandler, HTTPServer
 from qgis.server import QgsServer
 
+from oauth_settings import _env_bool
+
 
 try:
     QGIS_SERVER_DEFAULT_PORT = int(os.environ['QGIS_SERVER_DEFAULT_PORT'])
@@ -40,58 +57,396 @@ try:
     QGIS_SERVER_DEFAULT_SERVERNAME = os.environ['QGIS_SERVER_DEFAULT_SERVERNAME']
 except KeyError:
     QGIS_SERVER_DEFAULT_SERVERNAME = 'localhost'
+# Number of pre-forked worker processes, 0 serves from this process
+QGIS_SERVER_WORKERS = int(os.environ.get('QGIS_SERVER_WORKERS', 0))
+# Number of threads serving the requests in each process, 0 for no threads
+QGIS_SERVER_THREADS = int(os.environ.get('QGIS_SERVER_THREADS', 0))
+# A worker process is replaced after serving this number of requests, 0 never
+QGIS_SERVER_MAX_REQUESTS = int(os.environ.get('QGIS_SERVER_MAX_REQUESTS', 0))
+# Seconds an idle HTTP/1.1 connection is kept open, 0 disables keep-alive,
+# which is only enabled with QGIS_SERVER_THREADS: an idle connection holds
+# a thread
+QGIS_SERVER_KEEPALIVE_TIMEOUT = float(os.environ.get('QGIS_SERVER_KEEPALIVE_TIMEOUT', 5))
+# Maximum size in bytes of a POST body, larger requests are refused (413)
+QGIS_SERVER_MAX_BODY_SIZE = int(os.environ.get('QGIS_SERVER_MAX_BODY_SIZE', 10 * 1024 * 1024))
+# Print the CGI variables of each request
+QGIS_SERVER_DEBUG_ENV = _env_bool('QGIS_SERVER_DEBUG_ENV')
+# Authenticate the requests before (and outside of) QgsServer
+QGIS_SERVER_AUTH_GATEWAY = _env_bool('QGIS_SERVER_AUTH_GATEWAY')
 
 
-qgs_server = QgsServer()
+def get_filter_class():
+    """Return the OAuth 2 filter class of OAUTH2_AUTHORIZATION_SERVICE_PROVIDER"""
+    from oauth_settings import OAUTH2_AUTHORIZATION_SERVICE_PROVIDER
+    module = importlib.import_module('filters.%s' % OAUTH2_AUTHORIZATION_SERVICE_PROVIDER)
+    klass_name = 'OAuth2Filter%s' % OAUTH2_AUTHORIZATION_SERVICE_PROVIDER.title()
+    return getattr(module, klass_name)
 
-# OAuth 2 plugin loading start
-serverIface = qgs_server.serverInterface()
-from oauth_settings import *
-import importlib
-module = importlib.import_module('filters.%s' % OAUTH2_AUTHORIZATION_SERVICE_PROVIDER)
-klass_name = 'OAuth2Filter%s' % OAUTH2_AUTHORIZATION_SERVICE_PROVIDER.title()
-klass = getattr(module, klass_name)
-serverIface.registerFilter(klass(serverIface), 100)
-# OAuth 2 plugin loading End
+
+def make_qgs_server():
+    """Return a new QgsServer with the OAuth 2 filter registered"""
+    qgs_server = QgsServer()
+    # OAuth 2 plugin loading start
+    serverIface = qgs_server.serverInterface()
+    klass = get_filter_class()
+    serverIface.registerFilter(klass(serverIface), 100)
+    # OAuth 2 plugin loading End
+    return qgs_server
+
+
+class GatewayRequest(object):
+    """
+    The server interface and request handler seen by the gateway filter:
+    parameters and CGI environment of an HTTP request, the response
+    headers and body set by the filter.
+    """
+
+    def __init__(self, params, env):
+        self.params = params
+        self.env = env
+        self.headers = {}
+        self.body = ''
+
+    def requestHandler(self):
+        return self
+
+    def getEnv(self, name):
+        return self.env.get(name, '')
+
+    def parameterMap(self):
+        return dict(self.params)
+
+    def setParameter(self, name, value):
+        self.params[name] = value
+
+    def removeParameter(self, name):
+        self.params.pop(name, None)
+
+    def clearHeaders(self):
+        self.headers = {}
+
+    def setHeader(self, name, value):
+        self.headers[name.strip()] = value
+
+    def clearBody(self):
+        self.body = ''
+
+    def appendBody(self, body):
+        self.body += body
+
+
+def make_gateway_filter(serverIface):
+    """
+    Return an OAuth 2 filter reading the GatewayRequest of the current
+    thread instead of QgsServer
+    """
+    klass = get_filter_class()
+
+    class GatewayFilter(klass):
+        gateway_requests = threading.local()
+
+        def serverInterface(self):
+            return self.gateway_requests.request
+
+    return GatewayFilter(serverIface)
 
 
 class Handler(BaseHTTPRequestHandler):
+    # Buffer the status line and the headers, they are sent in a single
+    # write, the body is sent as is
+    wbufsize = -1
+    disable_nagle_algorithm = True
+    # Not forwarded from the QgsServer headers
+    skip_headers = frozenset(('status', 'content-length', 'connection',
+                              'transfer-encoding'))
+    # Header name -> CGI variable name, bounded: header names are chosen
+    # by the clients
+    cgi_names = {}
+    max_cgi_names = 1000
+    # Root element of an XML POST body (after the declaration and comments)
+    body_request_re = re.compile(br'<(?:[\w.-]+:)?([A-Za-z][\w.-]*)')
 
     def __init__(self, request, client_address, server):
         BaseHTTPRequestHandler.__init__(self, request, client_address, server)
 
+    def setup(self):
+        # Keep-alive (every response has a Content-Length) only with a
+        # thread pool: without, an idle client blocks all the others
+        if self.server.threads and QGIS_SERVER_KEEPALIVE_TIMEOUT > 0:
+            self.protocol_version = 'HTTP/1.1'
+            self.timeout = QGIS_SERVER_KEEPALIVE_TIMEOUT
+        BaseHTTPRequestHandler.setup(self)
+
     def do_GET(self):
-        # CGI vars:
-        for k, v in self.headers.dict.items():
-            qgs_server.putenv('HTTP_%s' % k.replace(' ', '-').replace('-', '_').replace(' ', '-').upper(), v)
-            print("Environment %s: %s" % ('HTTP_%s' % k.replace(' ', '-').replace('-', '_').replace(' ', '-').upper(), v))
-        qgs_server.putenv('SERVER_PORT', str(self.server.server_port))
-        qgs_server.putenv('SERVER_NAME', self.server.server_name)
-        qgs_server.putenv('REQUEST_URI', self.path)
-        parsed_path = urllib.parse.urlparse(self.path)
-        headers, body = qgs_server.handleRequest(parsed_path.query)
+        self.handle_qgs(urllib.parse.urlparse(self.path).query)
+
+    def handle_qgs(self, query):
+        self.server.served += 1
+        if self.server.gateway_filter is not None and self.handle_gateway():
+            return
+        # The CGI environment of QgsServer is process-wide: one request
+        # at a time per process, the threads overlap the socket I/O
+        with self.server.qgs_lock:
+            headers, body = self.handle_qgs_request(self.server.qgs_server, query)
         headers_dict = dict(h.split(': ', 1) for h in headers.decode().split('\n') if h)
+        self.send_qgs_response(headers_dict, body)
+        return
+
+    def send_qgs_response(self, headers, body):
+        """Send the status, headers and body set by QgsServer or by the filter"""
         try:
-            self.send_response(int(headers_dict['Status'].split(' ')[0]))
-        except:
+            self.send_response(int(headers['Status'].split(' ')[0]))
+        except (KeyError, ValueError):
             self.send_response(200)
-        for k, v in headers_dict.items():
-            self.send_header(k, v)
+        for k, v in headers.items():
+            if k.lower() not in self.skip_headers:
+                self.send_header(k, v)
+        if not isinstance(body, bytes):
+            body = bytes(body)
+        self.send_header('Content-Length', str(len(body)))
+        if self.server.stopping:
+            # Gracefully stopping: do not wait for another request
+            self.send_header('Connection', 'close')
         self.end_headers()
-        self.wfile.write(body)
-        return
+        self.wfile.flush()
+        # Large rendered images are not copied into the write buffer
+        self.connection.sendall(body)
+
+    def cgi_env(self):
+        """Return the CGI variables of the request"""
+        env = {}
+        names = self.cgi_names
+        for k, v in self.headers.dict.items():
+            name = names.get(k)
+            if name is None:
+                name = 'HTTP_' + k.replace(' ', '_').replace('-', '_').upper()
+                if len(names) < self.max_cgi_names:
+                    names[k] = name
+            env[name] = v
+        env['SERVER_PORT'] = str(self.server.server_port)
+        env['SERVER_NAME'] = self.server.server_name
+        env['REQUEST_URI'] = self.path
+        return env
+
+    def handle_qgs_request(self, qgs_server, query):
+        # CGI vars: only set the ones that changed since the previous
+        # request, reset the ones it had and this one has not
+        env = self.cgi_env()
+        previous = self.server.qgs_env
+        for k, v in env.items():
+            if previous.get(k) != v:
+                qgs_server.putenv(k, v)
+        for k in previous:
+            if k not in env:
+                qgs_server.putenv(k, '')
+        self.server.qgs_env = env
+        if QGIS_SERVER_DEBUG_ENV:
+            for k, v in sorted(env.items()):
+                print("Environment %s: %s" % (k, v))
+        return qgs_server.handleRequest(query)
+
+    def handle_gateway(self):
+        """
+        Run the OAuth 2 filter on the request in this thread, without the
+        QgsServer lock: answer the logins, redirects and errors and return
+        True, return False for the authorized requests.
+        """
+        query = urllib.parse.urlparse(self.path).query
+        params = dict((k.upper(), v) for k, v in
+                      urllib.parse.parse_qsl(query, keep_blank_values=True))
+        request = GatewayRequest(params, self.cgi_env())
+        gateway_filter = self.server.gateway_filter
+        gateway_filter.gateway_requests.request = request
+        gateway_filter.requestReady()
+        if request.parameterMap().get('REQUEST') != 'OAUTH2':
+            # Authorized: QgsServer runs the filter again (on a cache hit)
+            return False
+        gateway_filter.responseComplete()
+        self.send_qgs_response(request.headers, request.body)
+        return True
 
     def do_POST(self):
-        content_len = int(self.headers.get('content-length', 0))
-        post_body = self.rfile.read(content_len).decode()
-        request = post_body[1:post_body.find(' ')]
-        self.path = self.path + '&REQUEST_BODY=' + \
-            post_body.replace('&amp;', '') + '&REQUEST=' + request
-        return self.do_GET()
+        if self.headers.get('transfer-encoding', 'identity').lower() != 'identity':
+            self.send_error(411)
+            return
+        try:
+            content_len = int(self.headers.get('content-length', 0))
+        except ValueError:
+            self.send_error(400)
+            return
+        if content_len < 0:
+            self.send_error(400)
+            return
+        if content_len > QGIS_SERVER_MAX_BODY_SIZE:
+            self.send_error(413)
+            return
+        # The body is read once, and passed (percent-encoded) as it is: it
+        # is neither decoded nor appended to the request URI
+        post_body = self.rfile.read(content_len)
+        match = self.body_request_re.search(post_body)
+        query = [urllib.parse.urlparse(self.path).query,
+                 'REQUEST_BODY=' + urllib.parse.quote(post_body, safe='')]
+        if match:
+            query.append('REQUEST=' + match.group(1).decode('ascii'))
+        self.handle_qgs('&'.join(q for q in query if q))
+
+
+class QgisHTTPServer(HTTPServer):
+    """
+    HTTPServer with its own QgsServer, the requests are optionally served
+    by a pool of threads: serve() returns once stop() has been called or
+    max_requests requests have been served.
+    """
+    # Seconds between two checks of the stop flag
+    timeout = 1
+
+    def __init__(self, server_address, RequestHandlerClass, threads=0):
+        HTTPServer.__init__(self, server_address, RequestHandlerClass)
+        self.qgs_server = None
+        self.qgs_lock = threading.Lock()
+        # CGI variables set by the previous request
+        self.qgs_env = {}
+        self.gateway_filter = None
+        self.threads = threads
+        # Bounded: a busy worker process leaves the connections to the others
+        self.requests = queue.Queue(max(1, threads))
+        self.served = 0
+        self.stopping = False
+
+    def setup_qgs_server(self, gateway=False):
+        """Create the QgsServer and the gateway filter of this process"""
+        self.qgs_server = make_qgs_server()
+        # Reset the HTTP_ variables inherited from the environment
+        self.qgs_env = dict((k, v) for k, v in os.environ.items()
+                            if k.startswith('HTTP_'))
+        if gateway:
+            self.gateway_filter = make_gateway_filter(self.qgs_server.serverInterface())
+
+    def start_threads(self):
+        for i in range(self.threads):
+            thread = threading.Thread(target=self._serve_thread,
+                                      name='qgis-server-%s' % i)
+            thread.daemon = True
+            thread.start()
+
+    def _serve_thread(self):
+        while True:
+            request, client_address = self.requests.get()
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+                self.requests.task_done()
+
+    def process_request(self, request, client_address):
+        if self.threads:
+            self.requests.put((request, client_address))
+        else:
+            HTTPServer.process_request(self, request, client_address)
+
+    def stop(self, *args):
+        self.stopping = True
+
+    def serve(self, max_requests=0):
+        while not self.stopping and not (max_requests and self.served >= max_requests):
+            self.handle_request()
+        # Let the threads complete the queued requests
+        self.requests.join()
+
+
+def serve_worker(server, max_requests):
+    """Worker process main loop: SIGTERM and SIGINT stop it gracefully"""
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, server.stop)
+    signal.signal(signal.SIGINT, server.stop)
+    # Accepting a connection taken by another worker must not block
+    server.socket.setblocking(0)
+    # Each worker has its own QgsServer (and storage connections)
+    server.setup_qgs_server(QGIS_SERVER_AUTH_GATEWAY)
+    server.start_threads()
+    server.serve(max_requests)
+
+
+def run_workers(server, workers, max_requests):
+    """
+    Pre-fork worker processes serving from the listening socket of server,
+    replace them when they exit (i.e. after max_requests requests), on
+    SIGHUP start a new generation of workers and gracefully stop the old
+    one, on SIGTERM or SIGINT gracefully stop all of them.
+    """
+    # pid -> generation of the worker
+    children = {}
+    state = {'generation': 0, 'reload': False, 'stop': False}
+
+    def spawn():
+        pid = os.fork()
+        if pid == 0:
+            status = 0
+            try:
+                serve_worker(server, max_requests)
+            except Exception as e:
+                print('Worker %s failed: %s' % (os.getpid(), e))
+                status = 1
+            finally:
+                os._exit(status)
+        children[pid] = state['generation']
+
+    def kill(pids):
+        for pid in pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+
+    def on_reload(*args):
+        state['reload'] = True
+
+    def on_stop(*args):
+        state['stop'] = True
+
+    signal.signal(signal.SIGHUP, on_reload)
+    signal.signal(signal.SIGTERM, on_stop)
+    signal.signal(signal.SIGINT, on_stop)
+    for i in range(workers):
+        spawn()
+    while children:
+        if state['stop']:
+            state['stop'] = False
+            state['generation'] = None
+            kill(list(children))
+        if state['reload'] and state['generation'] is not None:
+            state['reload'] = False
+            old = list(children)
+            state['generation'] += 1
+            for i in range(workers):
+                spawn()
+            kill(old)
+            print('Reloading: %s new workers' % workers)
+        try:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+        except OSError as e:
+            if e.errno in (errno.EINTR, errno.ECHILD):
+                continue
+            raise
+        if not pid:
+            time.sleep(0.2)
+            continue
+        generation = children.pop(pid, None)
+        # Recycled or crashed worker of the current generation
+        if generation is not None and generation == state['generation']:
+            spawn()
 
 
 if __name__ == '__main__':
-    server = HTTPServer((QGIS_SERVER_DEFAULT_SERVERNAME, QGIS_SERVER_DEFAULT_PORT), Handler)
+    server = QgisHTTPServer((QGIS_SERVER_DEFAULT_SERVERNAME, QGIS_SERVER_DEFAULT_PORT),
+                            Handler, QGIS_SERVER_THREADS)
     print('Starting server on %s:%s, use <Ctrl-C> to stop' % (QGIS_SERVER_DEFAULT_SERVERNAME,
           QGIS_SERVER_DEFAULT_PORT))
-    server.serve_forever()
+    if QGIS_SERVER_WORKERS > 0:
+        run_workers(server, QGIS_SERVER_WORKERS, QGIS_SERVER_MAX_REQUESTS)
+    else:
+        server.setup_qgs_server(QGIS_SERVER_AUTH_GATEWAY)
+        server.start_threads()
+        server.serve_forever()
@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+"""
+Circuit breakers of the provider HTTP client
+
+.. note:: This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+"""
+
+__author__ = 'agent'
+__date__ = '10/18/2026'
+# This will get replaced with a git SHA1 when you do a git archive
+__revision__ = '$Format:%H$'
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import oauth_http
+from oauth_http import CircuitBreaker, CircuitOpenError, HttpClient
+from tests.utils import StubProvider
+
+
+class CircuitBreakerTest(unittest.TestCase):
+
+    def setUp(self):
+        # A clock moved by the tests
+        self.now = 1000.0
+        self.time = oauth_http.time
+        oauth_http.time = lambda: self.now
+        self.breaker = CircuitBreaker(max_failures=3, slow_call=2,
+                                      reset_timeout=30)
+
+    def tearDown(self):
+        oauth_http.time = self.time
+
+    def open(self):
+        for i in range(3):
+            self.assertTrue(self.breaker.allow())
+            self.breaker.record(0.1, True)
+        self.assertEqual(self.breaker.state, 'open')
+
+    def test_opens_after_failures(self):
+        for i in range(2):
+            self.assertTrue(self.breaker.allow())
+            self.breaker.record(0.1, True)
+        self.assertEqual(self.breaker.state, 'closed')
+        self.breaker.record(0.1, True)
+        self.assertEqual(self.breaker.state, 'open')
+        self.assertFalse(self.breaker.allow())
+
+    def test_opens_after_slow_calls(self):
+        for i in range(3):
+            self.assertEqual(self.breaker.state, 'closed')
+            self.breaker.record(2.5, False)
+        self.assertEqual(self.breaker.state, 'open')
+        self.assertFalse(self.breaker.allow())
+
+    def test_consecutive_failures_only(self):
+        self.breaker.record(0.1, True)
+        self.breaker.record(2.5, False)
+        self.breaker.record(0.1, False)
+        self.breaker.record(0.1, True)
+        self.breaker.record(0.1, True)
+        self.assertEqual(self.breaker.state, 'closed')
+
+    def test_no_slow_call_limit(self):
+        breaker = CircuitBreaker(max_failures=1, slow_call=0, reset_timeout=30)
+        breaker.record(60, False)
+        self.assertEqual(breaker.state, 'closed')
+
+    def test_single_trial(self):
+        self.open()
+        self.now += 29
+        self.assertFalse(self.breaker.allow())
+        self.now += 1
+        self.assertEqual(self.breaker.state, 'half-open')
+        self.assertTrue(self.breaker.allow())
+        # The trial is in flight
+        self.assertEqual(self.breaker.state, 'half-open')
+        self.assertFalse(self.breaker.allow())
+        self.assertFalse(self.breaker.allow())
+
+    def test_failed_trial_reopens(self):
+        self.open()
+        self.now += 30
+        self.assertTrue(self.breaker.allow())
+        # A single failure is enough
+        self.breaker.record(0.1, True)
+        self.assertEqual(self.breaker.state, 'open')
+        self.assertFalse(self.breaker.allow())
+        # For another reset_timeout
+        self.now += 29
+        self.assertFalse(self.breaker.allow())
+        self.now += 1
+        self.assertTrue(self.breaker.allow())
+
+    def test_slow_trial_reopens(self):
+        self.open()
+        self.now += 30
+        self.assertTrue(self.breaker.allow())
+        self.breaker.record(2.5, False)
+        self.assertEqual(self.breaker.state, 'open')
+
+    def test_successful_trial_closes(self):
+        self.open()
+        self.now += 30
+        self.assertTrue(self.breaker.allow())
+        self.breaker.record(0.1, False)
+        self.assertEqual(self.breaker.state, 'closed')
+        self.assertTrue(self.breaker.allow())
+        self.assertTrue(self.breaker.allow())
+        # The failures are counted again from zero
+        self.breaker.record(0.1, True)
+        self.breaker.record(0.1, True)
+        self.assertEqual(self.breaker.state, 'closed')
+
+
+class HttpClientBreakerTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.provider = StubProvider()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.provider.stop()
+
+    def setUp(self):
+        self.provider.server.jwks_fetches = 0
+        self.provider.server.jwks_status = 500
+        self.url = self.provider.url + '/jwks'
+        self.http = HttpClient(retries=0)
+        self.http.breakers[self.url] = CircuitBreaker(max_failures=2,
+                                                      slow_call=0,
+                                                      reset_timeout=60)
+
+    def test_rejected_while_open(self):
+        for i in range(2):
+            self.assertEqual(self.http.get(self.url).status_code, 500)
+        self.assertRaises(CircuitOpenError, self.http.get, self.url + '?a=1')
+        self.assertEqual(self.provider.server.jwks_fetches, 2)
+        stats = self.http.stats[self.url]
+        self.assertEqual((stats['calls'], stats['errors'], stats['rejected']),
+                         (2, 2, 1))
+
+    def test_endpoints_are_separate(self):
+        for i in range(2):
+            self.http.get(self.url)
+        self.assertEqual(self.http.get(self.provider.url + '/other').status_code,
+                         404)
+
+
+if __name__ == '__main__':
+    unittest.main()
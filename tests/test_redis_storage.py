@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+"""
+RedisCache tests against fakeredis, the Redis commands run in-process
+
+.. note:: This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+"""
+
+__author__ = 'agent'
+__date__ = '10/18/2026'
+# This will get replaced with a git SHA1 when you do a git archive
+__revision__ = '$Format:%H$'
+
+import os
+import sys
+import unittest
+from time import time, sleep
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fakeredis
+
+from oauth_storage import RedisCache, TokenRecordSerializer
+
+
+class RedisCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.client = fakeredis.FakeStrictRedis()
+        self.client.flushall()
+        # Count the pipelines
+        self.pipelines = 0
+        pipeline = self.client.pipeline
+
+        def counting_pipeline(*args, **kwargs):
+            self.pipelines += 1
+            return pipeline(*args, **kwargs)
+
+        self.client.pipeline = counting_pipeline
+        self.cache = RedisCache('oauth2:test:', default_timeout=60,
+                                client=self.client)
+
+    def test_set_get(self):
+        self.cache.set('token', {'sub': 'me'})
+        self.assertEqual(self.cache.get('token'), {'sub': 'me'})
+        self.assertEqual(self.cache['token'], {'sub': 'me'})
+        self.assertIsNone(self.cache.get('other'))
+        value, expire = self.cache.get_with_expiry('token')
+        self.assertAlmostEqual(expire, time() + 60, delta=1)
+
+    def test_keys_are_digests(self):
+        self.cache.set('secret-token', 1)
+        key, = self.client.keys()
+        self.assertTrue(key.startswith('oauth2:test:'))
+        self.assertNotIn('secret-token', key)
+        self.assertEqual(len(key), len('oauth2:test:') + 16)
+
+    def test_ttl_covers_stale_grace(self):
+        cache = RedisCache('oauth2:test:', client=self.client, stale_grace=30)
+        cache.set('token', 1, 10)
+        self.assertAlmostEqual(self.client.pttl(cache._key('token')), 40000, delta=100)
+
+    def test_stale(self):
+        cache = RedisCache('oauth2:test:', client=self.client, stale_grace=30)
+        cache.set('token', 1, 0.05)
+        sleep(0.1)
+        self.assertIsNone(cache.get('token'))
+        self.assertEqual(cache.get_stale('token')[0], 1)
+        # Expired server-side after the grace period
+        cache = RedisCache('oauth2:test:', client=self.client)
+        cache.set('token', 1, 0.05)
+        sleep(0.1)
+        self.assertEqual(cache.get_stale('token'), (None, None))
+        self.assertEqual(self.client.keys(), [])
+
+    def test_add(self):
+        self.assertTrue(self.cache.add('token', 1))
+        self.assertFalse(self.cache.add('token', 2))
+        self.assertEqual(self.cache.get('token'), 1)
+        self.cache.delete('token')
+        self.assertTrue(self.cache.add('token', 3))
+        self.assertEqual(self.cache.get('token'), 3)
+
+    def test_add_expired(self):
+        self.cache.set('token', 1, 0.05)
+        sleep(0.1)
+        self.assertTrue(self.cache.add('token', 2))
+
+    def test_many(self):
+        self.assertTrue(self.cache.set_many({'a': 1, 'b': 2, 'c': 3}))
+        self.assertEqual(self.pipelines, 1)
+        self.assertEqual(self.cache.get_many('c', 'missing', 'a', 'a'),
+                         [3, None, 1, 1])
+        self.assertEqual(self.pipelines, 2)
+        self.assertTrue(self.cache.delete_many('a', 'b', 'missing'))
+        self.assertEqual(self.cache.get_many('a', 'b', 'c'), [None, None, 3])
+        self.assertTrue(self.cache.delete_many())
+
+    def test_clear(self):
+        other = RedisCache('oauth2:other:', client=self.client)
+        other.set('token', 1)
+        self.cache.set_many(dict(('token%s' % i, i) for i in range(1200)))
+        self.assertTrue(self.cache.clear())
+        self.assertIsNone(self.cache.get('token1'))
+        self.assertEqual(len(self.client.keys()), 1)
+        self.assertEqual(other.get('token'), 1)
+
+    def test_lease(self):
+        leases = RedisCache('oauth2:lease:', default_timeout=10,
+                            client=self.client)
+        self.assertTrue(leases.add('token', 1234))
+        self.assertFalse(leases.add('token', 5678))
+        self.assertEqual(leases.get('token'), 1234)
+        self.assertAlmostEqual(self.client.pttl(leases._key('token')), 10000, delta=100)
+        leases.delete('token')
+        self.assertIsNone(leases.get('token'))
+        self.assertTrue(leases.add('token', 5678))
+
+    def test_token_records(self):
+        cache = RedisCache('oauth2:token:', client=self.client,
+                           serializer=TokenRecordSerializer())
+        cache.set('token', {'sub': 'me', 'scope': 'openid', 'aud': 'x' * 100,
+                            'refresh_token': 'r'})
+        record = cache.get('token')
+        self.assertEqual(record['sub'], 'me')
+        self.assertEqual(record['scope'], 'openid')
+        self.assertNotIn('aud', record)
+        # Only kept with OAUTH2_REFRESH_EXTEND_TOKENS
+        self.assertNotIn('refresh_token', record)
+
+
+if __name__ == '__main__':
+    unittest.main()
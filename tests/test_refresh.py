@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+"""
+Background refresh of the tokens in use
+
+.. note:: This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+"""
+
+__author__ = 'agent'
+__date__ = '10/18/2026'
+# This will get replaced with a git SHA1 when you do a git archive
+__revision__ = '$Format:%H$'
+
+import os
+import sys
+import unittest
+from time import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import filters.base
+import oauth_storage
+from oauth_http import HttpClient
+from oauth_settings import OAUTH2_REFRESH_AHEAD
+from tests.utils import FilterTestCase, StubProvider, SyncPool
+
+
+class RefreshTest(FilterTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.provider = StubProvider()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.provider.stop()
+
+    def setUp(self):
+        super(RefreshTest, self).setUp()
+        self.provider.server.tokens = {}
+        self.provider.server.introspected = []
+        self.filter = self.make_filter(
+            verify_url=self.provider.url + '/introspect', http=HttpClient())
+
+    def add_token(self, access_token, expires_in):
+        self.provider.server.tokens[access_token] = {
+            'active': True, 'sub': 'me', 'exp': time() + expires_in}
+
+    def ticks(self, count=5):
+        """Run count refresher checks, return the number of introspection calls"""
+        calls = len(self.provider.server.introspected)
+        for i in range(count):
+            self.filter.queue_refreshes(SyncPool())
+        return len(self.provider.server.introspected) - calls
+
+    def test_expiring_at_provider(self):
+        # Verifying it again cannot extend it
+        self.add_token('token', OAUTH2_REFRESH_AHEAD / 2)
+        self.assertTrue(self.filter.verify_and_store_access_token('token'))
+        self.filter.used_tokens['token'] = time()
+        self.assertEqual(self.ticks(), 0)
+        self.assertIn('token', self.filter.used_tokens)
+
+    def test_cached_for_less_than_provider_expiry(self):
+        self.add_token('token', OAUTH2_REFRESH_AHEAD * 10)
+        profile = self.filter.verify_access_token('token')
+        self.filter.store_access_token('token', profile, 10)
+        self.filter.used_tokens['token'] = time()
+        # Verified once, then cached up to its provider expiry
+        self.assertEqual(self.ticks(), 1)
+        expire = self.filter.token_storage.get_with_expiry('token')[1]
+        self.assertTrue(expire - time() > OAUTH2_REFRESH_AHEAD)
+        self.assertTrue(expire <= profile['exp'])
+
+    def test_revoked(self):
+        self.add_token('token', OAUTH2_REFRESH_AHEAD * 10)
+        profile = self.filter.verify_access_token('token')
+        self.filter.store_access_token('token', profile, 10)
+        self.filter.used_tokens['token'] = time()
+        self.provider.server.tokens['token']['active'] = False
+        self.assertEqual(self.ticks(), 1)
+        self.assertIsNone(self.filter.token_storage.get('token'))
+        self.assertNotIn('token', self.filter.used_tokens)
+
+    def test_idle(self):
+        self.add_token('token', OAUTH2_REFRESH_AHEAD * 10)
+        profile = self.filter.verify_access_token('token')
+        self.filter.store_access_token('token', profile, 10)
+        self.filter.used_tokens['token'] = 0
+        self.assertEqual(self.ticks(), 0)
+        self.assertNotIn('token', self.filter.used_tokens)
+
+    def test_extend_with_refresh_token(self):
+        refreshed = []
+
+        def refresh_access_token(refresh_token):
+            refreshed.append(refresh_token)
+            return {'access_token': 'new', 'expires_in': OAUTH2_REFRESH_AHEAD * 10}
+
+        self.filter.refresh_access_token = refresh_access_token
+        extend = filters.base.OAUTH2_REFRESH_EXTEND_TOKENS
+        filters.base.OAUTH2_REFRESH_EXTEND_TOKENS = True
+        oauth_storage.OAUTH2_REFRESH_EXTEND_TOKENS = True
+        try:
+            self.filter.store_access_token(
+                'token', {'sub': 'me', 'refresh_token': 'refresh',
+                          'expires_in': OAUTH2_REFRESH_AHEAD / 2})
+            self.filter.used_tokens['token'] = time()
+            self.assertEqual(self.ticks(), 0)
+        finally:
+            filters.base.OAUTH2_REFRESH_EXTEND_TOKENS = extend
+            oauth_storage.OAUTH2_REFRESH_EXTEND_TOKENS = extend
+        self.assertEqual(refreshed, ['refresh'])
+        expire = self.filter.token_storage.get_with_expiry('token')[1]
+        self.assertTrue(expire - time() > OAUTH2_REFRESH_AHEAD)
+        self.assertIsNone(self.filter.token_storage.get('new'))
+
+    def test_refresh_token_not_stored(self):
+        self.filter.store_access_token(
+            'token', {'sub': 'me', 'refresh_token': 'refresh',
+                      'expires_in': OAUTH2_REFRESH_AHEAD / 2})
+        self.assertNotIn('refresh_token', self.filter.token_storage.get('token'))
+
+
+if __name__ == '__main__':
+    unittest.main()
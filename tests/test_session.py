@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+"""
+Session cookies and signed states
+
+.. note:: This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+"""
+
+__author__ = 'agent'
+__date__ = '10/18/2026'
+# This will get replaced with a git SHA1 when you do a git archive
+__revision__ = '$Format:%H$'
+
+import os
+import sys
+import unittest
+from time import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import filters.base
+from oauth_session import SessionCookie
+from filters.base import OAuthException
+from tests.utils import FilterTestCase
+
+
+class SessionCookieTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cookies = SessionCookie('secret', 'session', 3600)
+
+    def test_round_trip(self):
+        value = self.cookies.dumps('token', time() + 600, 'me')
+        session = self.cookies.loads(value)
+        self.assertEqual(session['t'], 'token')
+        self.assertEqual(session['sub'], 'me')
+        self.assertNotIn('token', value)
+        session = self.cookies.from_header('other=1; session=%s; last=2' % value)
+        self.assertEqual(session['t'], 'token')
+
+    def test_header(self):
+        header = self.cookies.header('token', 600, 'me', secure=True)
+        self.assertIn('Max-Age=600;', header)
+        self.assertIn('HttpOnly;', header)
+        self.assertIn('Secure;', header)
+        self.assertEqual(self.cookies.from_header(header.split(';')[0])['t'],
+                         'token')
+        # Never outlives the cookie max age
+        self.assertIn('Max-Age=3600;', self.cookies.header('token', 7200))
+
+    def test_tampered(self):
+        value = self.cookies.dumps('token', time() + 600)
+        for i in (0, len(value) / 2, len(value) - 2):
+            tampered = value[:i] + ('A' if value[i] != 'A' else 'B') + value[i + 1:]
+            self.assertIsNone(self.cookies.loads(tampered))
+        other = SessionCookie('other secret', 'session', 3600)
+        self.assertIsNone(other.loads(value))
+
+    def test_expired(self):
+        self.assertIsNone(self.cookies.loads(self.cookies.dumps('token', time() - 1)))
+
+    def test_malformed(self):
+        for value in (None, '', 'garbage', u'\xe9t\xe9', '{"t": "token"}'):
+            self.assertIsNone(self.cookies.loads(value))
+        for header in (None, '', 'other=1', 'session', 'session=', 'session=garbage',
+                       'session="unterminated', 'session=\x00\xff'):
+            self.assertIsNone(self.cookies.from_header(header))
+
+
+class StateTest(FilterTestCase):
+
+    def setUp(self):
+        super(StateTest, self).setUp()
+        self.filter = self.make_filter()
+
+    def test_round_trip(self):
+        url = 'https://example.com/wms?a=1:2&b=.'
+        state = self.filter.make_state(url)
+        self.assertEqual(self.filter.parse_state(state), url)
+        # Each state has its own nonce
+        self.assertNotEqual(self.filter.make_state(url), state)
+
+    def test_tampered(self):
+        state = self.filter.make_state('https://example.com/')
+        payload, signature = state.split('.')
+        forged = self.filter.make_state('https://evil.example.com/')
+        for tampered in (forged.split('.')[0] + '.' + signature,
+                         payload + '.' + forged.split('.')[1],
+                         payload + '.',
+                         payload[:-1] + ('A' if payload[-1] != 'A' else 'B') + '.' + signature):
+            self.assertRaises(OAuthException, self.filter.parse_state, tampered)
+
+    def test_expired(self):
+        ttl = filters.base.OAUTH2_STATE_TTL
+        filters.base.OAUTH2_STATE_TTL = -10
+        try:
+            state = self.filter.make_state('https://example.com/')
+        finally:
+            filters.base.OAUTH2_STATE_TTL = ttl
+        self.assertRaises(OAuthException, self.filter.parse_state, state)
+
+    def test_malformed(self):
+        for state in ('', '.', 'garbage', 'a.b.c', '!!!.???', u'\xe9t\xe9.\xe9t\xe9'):
+            self.assertRaises(OAuthException, self.filter.parse_state, state)
+
+
+class SessionFilterTest(FilterTestCase):
+    """Session cookies in get_access_token()"""
+
+    def setUp(self):
+        super(SessionFilterTest, self).setUp()
+        self.cookies = SessionCookie('secret', 'session', 3600)
+        self.verified = []
+
+    def get_access_token(self, cookie=None, token=None):
+        cookies = self.cookies
+        verified = self.verified
+
+        def verify_access_token(self, access_token):
+            verified.append(access_token)
+            if access_token.startswith('valid'):
+                return {'sub': access_token, 'expires_in': 600}
+            return False
+
+        env = {}
+        if cookie:
+            env['HTTP_COOKIE'] = 'session=%s' % cookie
+        if token:
+            env['HTTP_AUTHORIZATION'] = 'Bearer %s' % token
+        self.filter = self.make_filter(
+            env=env, get_session_cookies=lambda self: cookies,
+            verify_access_token=verify_access_token,
+            verify_jwt_access_token=lambda self, access_token: None)
+        return self.filter.get_access_token()
+
+    def test_cookie_only(self):
+        cookie = self.cookies.dumps('valid-1', time() + 600)
+        self.assertEqual(self.get_access_token(cookie), 'valid-1')
+        self.assertEqual(self.verified, [])
+
+    def test_cookie_of_the_token(self):
+        cookie = self.cookies.dumps('valid-1', time() + 600)
+        self.assertEqual(self.get_access_token(cookie, 'valid-1'), 'valid-1')
+        self.assertEqual(self.verified, [])
+
+    def test_new_token(self):
+        # A new login: the token is verified and gets its own cookie
+        cookie = self.cookies.dumps('valid-1', time() + 600)
+        self.assertEqual(self.get_access_token(cookie, 'valid-2'), 'valid-2')
+        self.assertEqual(self.verified, ['valid-2'])
+        header = self.filter.context.session_cookie
+        self.assertEqual(self.cookies.from_header(header.split(';')[0])['t'],
+                         'valid-2')
+
+    def test_new_invalid_token(self):
+        cookie = self.cookies.dumps('valid-1', time() + 600)
+        self.assertRaises(OAuthException, self.get_access_token, cookie,
+                          'invalid')
+        self.assertEqual(self.verified, ['invalid'])
+
+    def test_short_lived_token(self):
+        # Max-Age=0 would delete the cookie
+        self.assertEqual(self.get_access_token(token='valid-1'), 'valid-1')
+        self.assertTrue(self.filter.context.session_cookie)
+        self.filter.context.session_cookie = None
+        self.filter.set_session_cookie('valid-1', {'expires_in': 0.5})
+        self.assertIsNone(self.filter.context.session_cookie)
+
+
+if __name__ == '__main__':
+    unittest.main()
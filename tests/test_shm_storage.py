@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+"""
+SharedMemoryCache tests
+
+.. note:: This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+"""
+
+__author__ = 'agent'
+__date__ = '10/18/2026'
+# This will get replaced with a git SHA1 when you do a git archive
+__revision__ = '$Format:%H$'
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from oauth_storage import SharedMemoryCache
+
+
+class SharedMemoryCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'table')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_shared(self):
+        cache = SharedMemoryCache(self.path, slots=64, value_size=64)
+        cache.set('token', {'sub': 'me'})
+        other = SharedMemoryCache(self.path, slots=64, value_size=64)
+        self.assertEqual(other.get('token'), {'sub': 'me'})
+        self.assertEqual(os.listdir(self.dir), ['table.64.64'])
+
+    def test_layout_change(self):
+        cache = SharedMemoryCache(self.path, slots=64, value_size=64)
+        cache.set('token', 1)
+        size = os.path.getsize(cache.path)
+        # Another layout gets its own table, the one in use is untouched
+        resized = SharedMemoryCache(self.path, slots=128, value_size=64)
+        self.assertNotEqual(resized.path, cache.path)
+        self.assertIsNone(resized.get('token'))
+        self.assertEqual(os.path.getsize(cache.path), size)
+        self.assertEqual(cache.get('token'), 1)
+
+    def test_incompatible_table(self):
+        with open(self.path + '.64.64', 'wb') as f:
+            f.write('not a token table')
+        self.assertRaises(Exception, SharedMemoryCache, self.path,
+                          slots=64, value_size=64)
+        self.assertEqual(os.path.getsize(self.path + '.64.64'), 17)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+"""
+SqliteCache tests
+
+.. note:: This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+"""
+
+__author__ = 'agent'
+__date__ = '10/18/2026'
+# This will get replaced with a git SHA1 when you do a git archive
+__revision__ = '$Format:%H$'
+
+import os
+import sys
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from time import sleep
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from oauth_storage import SqliteCache
+
+
+class SqliteCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def make_cache(self, **kwargs):
+        kwargs.setdefault('sweep_interval', 0)
+        return SqliteCache(self.path, **kwargs)
+
+    def test_clear_removes_legacy_files(self):
+        # A database for each key, as stored by previous versions
+        for name in ('1234567890', '-987654321'):
+            conn = sqlite3.Connection(os.path.join(self.path, name))
+            conn.execute('CREATE TABLE bucket (key TEXT PRIMARY KEY, val BLOB, exp FLOAT)')
+            conn.close()
+        os.mkdir(os.path.join(self.path, 'folder'))
+        cache = self.make_cache(shards=2)
+        cache.set_many(dict(('token%s' % i, i) for i in range(20)))
+        cache.clear()
+        self.assertEqual(cache.get_many('token1', 'token2'), [None, None])
+        names = set(os.listdir(self.path))
+        self.assertFalse(names & set(['1234567890', '-987654321']))
+        self.assertIn('folder', names)
+        self.assertIn('shard_0.sqlite', names)
+        self.assertIn('shard_1.sqlite', names)
+        # The shards are still usable
+        cache.set('token', 1)
+        self.assertEqual(cache.get('token'), 1)
+
+    def test_sweep_max_entries(self):
+        cache = self.make_cache(shards=2, max_entries=10)
+        cache.set_many(dict(('token%s' % i, i) for i in range(40)))
+        cache.sweep()
+        # Each shard keeps up to max_entries // shards entries
+        values = cache.get_many(*['token%s' % i for i in range(40)])
+        self.assertEqual(len([v for v in values if v is not None]), 10)
+
+    def test_sweep_more_shards_than_entries(self):
+        cache = self.make_cache(shards=4, max_entries=2)
+        cache.set_many(dict(('token%s' % i, i) for i in range(40)))
+        cache.sweep()
+        # Rounded up to one entry for each shard, the storage is not emptied
+        values = cache.get_many(*['token%s' % i for i in range(40)])
+        self.assertTrue(values.count(None) < 40)
+
+    def test_get_many_batches(self):
+        # More keys than SQLite host parameters in a single shard
+        for shards in (1, 3):
+            cache = SqliteCache(os.path.join(self.path, str(shards)),
+                                shards=shards, sweep_interval=0)
+            keys = ['token%s' % i for i in range(2000)]
+            cache.set_many(dict((key, i) for i, key in enumerate(keys)))
+            shard_keys = cache._group_by_shard(keys)
+            self.assertEqual(len(shard_keys), shards)
+            self.assertTrue(max(len(k) for k in shard_keys.values()) > cache._many_batch)
+            keys.reverse()
+            self.assertEqual(cache.get_many('missing', *keys),
+                             [None] + range(1999, -1, -1))
+
+    def test_get_many_expired(self):
+        cache = self.make_cache(shards=2)
+        cache.set_many(dict(('token%s' % i, i) for i in range(10)))
+        cache.set_many(dict(('expired%s' % i, i) for i in range(10)), 0.05)
+        sleep(0.1)
+        self.assertEqual(cache.get_many('expired1', 'token1', 'expired2', 'token2'),
+                         [None, 1, None, 2])
+        # Kept for get_stale() until swept
+        cache.stale_grace = 30
+        self.assertEqual(cache.get_stale('expired1')[0], 1)
+
+    def test_delete_many(self):
+        cache = self.make_cache(shards=3)
+        keys = ['token%s' % i for i in range(1200)]
+        cache.set_many(dict((key, i) for i, key in enumerate(keys)))
+        self.assertTrue(cache.delete_many('missing', *keys[:1100]))
+        self.assertEqual(cache.get_many(*keys[1099:1102]), [None, 1100, 1101])
+        self.assertEqual(cache.get_many(*keys).count(None), 1100)
+        self.assertTrue(cache.delete_many())
+        self.assertEqual(cache.get('token1199'), 1199)
+
+    def test_private(self):
+        path = os.path.join(self.path, 'storage')
+        cache = SqliteCache(path, sweep_interval=0)
+        cache.set('token', 1)
+        self.assertEqual(os.stat(path).st_mode & 0777, 0700)
+        for name in os.listdir(path):
+            self.assertEqual(os.stat(os.path.join(path, name)).st_mode & 0077, 0, name)
+        # Created by previous versions
+        os.chmod(path, 0755)
+        SqliteCache(path, sweep_interval=0)
+        self.assertEqual(os.stat(path).st_mode & 0777, 0700)
+
+
+if __name__ == '__main__':
+    unittest.main()
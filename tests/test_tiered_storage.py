@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+"""
+TieredCache tests
+
+.. note:: This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+"""
+
+__author__ = 'agent'
+__date__ = '10/18/2026'
+# This will get replaced with a git SHA1 when you do a git archive
+__revision__ = '$Format:%H$'
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from oauth_storage import (SqliteCache, MemoryCache, TieredCache,
+                           TokenRecordSerializer)
+
+
+class TieredCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.storage = SqliteCache(self.path, sweep_interval=0,
+                                   serializer=TokenRecordSerializer())
+        self.cache = TieredCache(self.storage, MemoryCache(100, 60))
+        self.token_info = {'sub': 'me', 'scope': 'openid', 'aud': 'client',
+                           'access_token': 'token', 'expires_in': 600}
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_same_value_from_both_tiers(self):
+        self.cache.set('token', self.token_info)
+        # From L1
+        cached = self.cache.get('token')
+        self.assertEqual(cached, self.storage.get('token'))
+        self.assertNotIn('aud', cached)
+        self.assertNotIn('access_token', cached)
+        # From L2
+        self.cache.cache.clear()
+        self.assertEqual(self.cache.get('token'), cached)
+
+    def test_set_many(self):
+        self.cache.set_many({'token': self.token_info, 'other': {'sub': 'other'}})
+        self.assertEqual(self.cache.get_many('token', 'other'),
+                         self.storage.get_many('token', 'other'))
+
+    def test_copy(self):
+        storage = SqliteCache(os.path.join(self.path, 'pickle'), sweep_interval=0)
+        cache = TieredCache(storage, MemoryCache(100, 60))
+        value = {'sub': 'me'}
+        cache.set('token', value)
+        value['sub'] = 'other'
+        self.assertEqual(cache.get('token'), {'sub': 'me'})
+
+
+if __name__ == '__main__':
+    unittest.main()
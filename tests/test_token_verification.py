@@ -0,0 +1,301 @@
+# -*- coding: utf-8 -*-
+"""
+Local JWT validation against a JWKS and RFC 7662 token introspection,
+both served by a stub provider on localhost
+
+.. note:: This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+"""
+
+__author__ = 'agent'
+__date__ = '10/18/2026'
+# This will get replaced with a git SHA1 when you do a git archive
+__revision__ = '$Format:%H$'
+
+import os
+import sys
+import json
+import base64
+import unittest
+from time import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import jwt
+from jwt.algorithms import RSAAlgorithm
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+from oauth_http import HttpClient
+from oauth_jwt import JwksValidator
+from oauth_settings import (OAUTH2_CLIENT_ID, OAUTH2_CLIENT_SECRET,
+                            OAUTH2_TOKEN_TTL_JITTER)
+from filters.base import OAuthException
+from tests.utils import FilterTestCase, StubProvider
+
+
+ISSUER = 'https://issuer.example.com/'
+AUDIENCE = 'client'
+
+
+def make_key():
+    return rsa.generate_private_key(public_exponent=65537, key_size=2048,
+                                    backend=default_backend())
+
+
+def make_jwk(kid, key):
+    jwk = json.loads(RSAAlgorithm.to_jwk(key.public_key()))
+    jwk.update({'kid': kid, 'alg': 'RS256', 'use': 'sig'})
+    return jwk
+
+
+class JwksValidatorTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.provider = StubProvider()
+        cls.key = make_key()
+        cls.rotated_key = make_key()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.provider.stop()
+
+    def setUp(self):
+        self.provider.server.jwks = [make_jwk('k1', self.key)]
+        self.provider.server.jwks_fetches = 0
+        self.provider.server.jwks_status = 200
+        self.validator = self.make_validator()
+
+    def make_validator(self, **kwargs):
+        kwargs.setdefault('min_refresh_interval', 0)
+        return JwksValidator(self.provider.url + '/jwks', ISSUER,
+                             audience=AUDIENCE, algorithms=['RS256'],
+                             refresh_interval=3600, leeway=30,
+                             http=HttpClient(), **kwargs)
+
+    def make_token(self, kid='k1', key=None, **claims):
+        payload = {'iss': ISSUER, 'aud': AUDIENCE, 'sub': 'me',
+                   'exp': int(time()) + 300}
+        payload.update(claims)
+        payload = dict((k, v) for k, v in payload.items() if v is not None)
+        return jwt.encode(payload, key or self.key, algorithm='RS256',
+                          headers={'kid': kid})
+
+    def test_valid(self):
+        claims = self.validator.validate(self.make_token())
+        self.assertEqual(claims['sub'], 'me')
+        self.assertEqual(self.provider.server.jwks_fetches, 1)
+        # The keys are cached
+        self.assertTrue(self.validator.validate(self.make_token(sub='other')))
+        self.assertEqual(self.provider.server.jwks_fetches, 1)
+
+    def test_not_a_jwt(self):
+        self.assertIsNone(self.validator.validate('an-opaque-token'))
+
+    def test_bad_audience(self):
+        self.assertFalse(self.validator.validate(self.make_token(aud='other')))
+
+    def test_bad_issuer(self):
+        self.assertFalse(self.validator.validate(
+            self.make_token(iss='https://evil.example.com/')))
+
+    def test_expired(self):
+        self.assertFalse(self.validator.validate(
+            self.make_token(exp=int(time()) - 60)))
+        # Within the leeway
+        self.assertTrue(self.validator.validate(
+            self.make_token(exp=int(time()) - 10)))
+
+    def test_no_expiry(self):
+        self.assertFalse(self.validator.validate(self.make_token(exp=None)))
+
+    def test_bad_signature(self):
+        self.assertFalse(self.validator.validate(
+            self.make_token(key=self.rotated_key)))
+
+    def test_unknown_kid_refreshes(self):
+        self.assertTrue(self.validator.validate(self.make_token()))
+        self.assertEqual(self.provider.server.jwks_fetches, 1)
+        token = self.make_token(kid='k2', key=self.rotated_key)
+        # Not validated locally
+        self.assertIsNone(self.validator.validate(token))
+        self.assertEqual(self.provider.server.jwks_fetches, 2)
+        # The provider rotates its keys
+        self.provider.server.jwks.append(make_jwk('k2', self.rotated_key))
+        self.assertEqual(self.validator.validate(token)['sub'], 'me')
+        self.assertEqual(self.provider.server.jwks_fetches, 3)
+
+    def test_unknown_kid_refresh_is_rate_limited(self):
+        validator = self.make_validator(min_refresh_interval=60)
+        self.assertTrue(validator.validate(self.make_token()))
+        self.provider.server.jwks.append(make_jwk('k2', self.rotated_key))
+        token = self.make_token(kid='k2', key=self.rotated_key)
+        self.assertIsNone(validator.validate(token))
+        self.assertIsNone(validator.validate(token))
+        self.assertEqual(self.provider.server.jwks_fetches, 1)
+
+    def test_jwks_unavailable(self):
+        self.provider.server.jwks_status = 500
+        self.assertIsNone(self.validator.validate(self.make_token()))
+        self.assertEqual(self.provider.server.jwks_fetches, 1)
+        # Available again
+        self.provider.server.jwks_status = 200
+        self.assertTrue(self.validator.validate(self.make_token()))
+
+
+class JwtFilterTest(FilterTestCase):
+    """Local JWT validation in get_access_token(), falling back to the provider"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.provider = StubProvider()
+        cls.key = make_key()
+        cls.rotated_key = make_key()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.provider.stop()
+
+    def setUp(self):
+        super(JwtFilterTest, self).setUp()
+        self.provider.server.jwks = [make_jwk('k1', self.key)]
+        self.provider.server.jwks_status = 200
+        self.provider.server.tokens = {}
+        self.provider.server.introspected = []
+        self.validator = JwksValidator(self.provider.url + '/jwks', ISSUER,
+                                       audience=AUDIENCE, algorithms=['RS256'],
+                                       min_refresh_interval=0, http=HttpClient())
+
+    def get_access_token(self, token):
+        validator = self.validator
+        oauth_filter = self.make_filter(
+            params={'ACCESS_TOKEN': token},
+            verify_url=self.provider.url + '/introspect', http=HttpClient(),
+            get_jwt_validator=lambda self: validator)
+        return oauth_filter.get_access_token()
+
+    def make_token(self, kid='k1', key=None):
+        token = jwt.encode({'iss': ISSUER, 'aud': AUDIENCE, 'sub': 'me',
+                            'exp': int(time()) + 300},
+                           key or self.key, algorithm='RS256',
+                           headers={'kid': kid})
+        self.provider.server.tokens[token] = {'active': True, 'sub': 'me',
+                                              'exp': int(time()) + 300}
+        return token
+
+    def test_valid(self):
+        token = self.make_token()
+        self.assertEqual(self.get_access_token(token), token)
+        self.assertEqual(self.provider.server.introspected, [])
+
+    def test_invalid(self):
+        token = self.make_token(key=self.rotated_key)
+        self.assertRaises(OAuthException, self.get_access_token, token)
+        self.assertEqual(self.provider.server.introspected, [])
+
+    def test_rotated_key(self):
+        token = self.make_token(kid='k2', key=self.rotated_key)
+        self.assertEqual(self.get_access_token(token), token)
+        self.assertEqual(len(self.provider.server.introspected), 1)
+
+    def test_jwks_unavailable(self):
+        self.provider.server.jwks_status = 500
+        token = self.make_token()
+        self.assertEqual(self.get_access_token(token), token)
+        self.assertEqual(len(self.provider.server.introspected), 1)
+        # Rejected by the provider
+        self.provider.server.tokens[token]['active'] = False
+        self.token_storage.delete(token)
+        self.assertRaises(OAuthException, self.get_access_token, token)
+
+
+class IntrospectionTest(FilterTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.provider = StubProvider()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.provider.stop()
+
+    def setUp(self):
+        super(IntrospectionTest, self).setUp()
+        self.exp = int(time()) + 300
+        self.provider.server.tokens = {
+            'active': {'active': True, 'sub': 'me', 'scope': 'openid',
+                       'exp': self.exp},
+            'inactive': {'active': False},
+            'expired': {'active': True, 'sub': 'me', 'exp': int(time()) - 1},
+            'truthy': {'active': 'true', 'sub': 'me'},
+        }
+        self.provider.server.introspected = []
+        self.provider.server.authorizations = []
+        self.filter = self.make_introspecting_filter()
+
+    def make_introspecting_filter(self, verify_url='/introspect', token=None):
+        if verify_url:
+            verify_url = self.provider.url + verify_url
+        return self.make_filter(params={'ACCESS_TOKEN': token},
+                                verify_url=verify_url, http=HttpClient())
+
+    def test_active(self):
+        profile = self.filter.verify_access_token('active')
+        self.assertEqual(profile['sub'], 'me')
+        form, = self.provider.server.introspected
+        self.assertEqual(form, {'token': ['active'],
+                                'token_type_hint': ['access_token']})
+        # Authenticated as the client
+        credentials = '%s:%s' % (OAUTH2_CLIENT_ID, OAUTH2_CLIENT_SECRET)
+        self.assertEqual(self.provider.server.authorizations,
+                         ['Basic ' + base64.b64encode(credentials)])
+
+    def test_cached_until_exp(self):
+        self.assertTrue(self.filter.verify_and_store_access_token('active'))
+        record, expire = self.token_storage.get_with_expiry('active')
+        self.assertEqual(record['sub'], 'me')
+        self.assertEqual(record['scope'], 'openid')
+        self.assertEqual(record['exp'], self.exp)
+        self.assertTrue(expire <= self.exp)
+        # Only shortened by the jitter
+        self.assertTrue(expire >= self.exp - 300 * OAUTH2_TOKEN_TTL_JITTER - 1)
+
+    def test_request(self):
+        oauth_filter = self.make_introspecting_filter(token='active')
+        self.assertEqual(oauth_filter.get_access_token(), 'active')
+        self.assertTrue(self.token_storage.get_with_expiry('active')[1] <= self.exp)
+        # Served from the storage
+        self.assertEqual(self.make_introspecting_filter(token='active').get_access_token(),
+                         'active')
+        self.assertEqual(len(self.provider.server.introspected), 1)
+
+    def test_inactive(self):
+        self.assertFalse(self.filter.verify_access_token('inactive'))
+        self.assertFalse(self.filter.verify_access_token('unknown'))
+        oauth_filter = self.make_introspecting_filter(token='inactive')
+        self.assertRaises(OAuthException, oauth_filter.get_access_token)
+        self.assertIsNone(self.token_storage.get('inactive'))
+
+    def test_expired(self):
+        self.assertFalse(self.filter.verify_access_token('expired'))
+        self.assertFalse(self.filter.verify_and_store_access_token('expired'))
+        self.assertIsNone(self.token_storage.get('expired'))
+
+    def test_active_must_be_true(self):
+        self.assertFalse(self.filter.verify_access_token('truthy'))
+
+    def test_provider_error(self):
+        oauth_filter = self.make_introspecting_filter('/missing')
+        self.assertFalse(oauth_filter.verify_access_token('active'))
+
+    def test_not_configured(self):
+        oauth_filter = self.make_introspecting_filter(None)
+        self.assertFalse(oauth_filter.verify_access_token('active'))
+        self.assertEqual(self.provider.server.introspected, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
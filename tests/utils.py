@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+"""
+Test helpers: a stub OAuth 2 provider on localhost and filters serving
+fake QGIS Server requests
+
+.. note:: This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+"""
+
+__author__ = 'agent'
+__date__ = '10/18/2026'
+# This will get replaced with a git SHA1 when you do a git archive
+__revision__ = '$Format:%H$'
+
+import os
+import sys
+import json
+import shutil
+import urlparse
+import tempfile
+import threading
+import unittest
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from oauth_storage import (SqliteCache, MemoryCache, TokenRecordSerializer,
+                           token_cache)
+from filters.base import OAuth2FilterBase
+
+
+class ProviderHandler(BaseHTTPRequestHandler):
+    """JWKS at /jwks, introspection of the tokens in server.tokens at /introspect"""
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, code, data):
+        body = json.dumps(data)
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path != '/jwks':
+            return self.send_json(404, {})
+        self.server.jwks_fetches += 1
+        if self.server.jwks_status != 200:
+            return self.send_json(self.server.jwks_status, {})
+        self.send_json(200, {'keys': self.server.jwks})
+
+    def do_POST(self):
+        if self.path != '/introspect':
+            return self.send_json(404, {})
+        if not self.headers.getheader('Authorization', '').startswith('Basic '):
+            return self.send_json(401, {'error': 'invalid_client'})
+        self.server.authorizations.append(self.headers.getheader('Authorization'))
+        length = int(self.headers.getheader('Content-Length', 0))
+        form = urlparse.parse_qs(self.rfile.read(length))
+        self.server.introspected.append(form)
+        token = form.get('token', [''])[0]
+        self.send_json(200, self.server.tokens.get(token, {'active': False}))
+
+
+class StubProvider(object):
+    """ProviderHandler served in a thread on 127.0.0.1"""
+
+    def __init__(self):
+        self.server = HTTPServer(('127.0.0.1', 0), ProviderHandler)
+        self.server.jwks = []
+        self.server.jwks_fetches = 0
+        self.server.jwks_status = 200
+        self.server.tokens = {}
+        self.server.introspected = []
+        self.server.authorizations = []
+        self.url = 'http://127.0.0.1:%s' % self.server.server_port
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class FakeRequestHandler(object):
+    """The subset of QgsRequestHandler used by the filters"""
+
+    def __init__(self, params=None):
+        self.params = dict(params or {})
+        self.headers = {}
+        self.body = ''
+
+    def parameterMap(self):
+        return dict(self.params)
+
+    def setParameter(self, key, value):
+        self.params[key] = value
+
+    def removeParameter(self, key):
+        self.params.pop(key, None)
+
+    def clearHeaders(self):
+        self.headers = {}
+
+    def setHeader(self, key, value):
+        self.headers[key] = value
+
+    def clearBody(self):
+        self.body = ''
+
+    def appendBody(self, body):
+        self.body += body
+
+
+class FakeServerInterface(object):
+    """The subset of QgsServerInterface used by the filters"""
+
+    def __init__(self, params=None, env=None):
+        self.request = FakeRequestHandler(params)
+        self.env = dict(env or {})
+
+    def requestHandler(self):
+        return self.request
+
+    def getEnv(self, name):
+        return self.env.get(name, '')
+
+
+class SyncPool(object):
+    """A ThreadPool running the calls in the calling thread"""
+
+    def apply_async(self, func, args=()):
+        func(*args)
+
+
+class FilterTestCase(unittest.TestCase):
+    """Filters with their own storages in a temporary folder"""
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.token_storage = token_cache(SqliteCache(
+            os.path.join(self.path, 'token'), sweep_interval=0,
+            serializer=TokenRecordSerializer()))
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def make_filter(self, klass=OAuth2FilterBase, params=None, env=None,
+                    **attributes):
+        """
+        Return a filter of a subclass of klass serving a request with
+        params and the CGI variables env, attributes override the class
+        attributes
+        """
+        iface = FakeServerInterface(params, env)
+        attributes.setdefault('token_storage', self.token_storage)
+        attributes.setdefault('rejected_tokens', MemoryCache(100, 10))
+        attributes.setdefault('verify_leases', MemoryCache(100, 10))
+        attributes.setdefault('used_tokens', {})
+        attributes.setdefault('refreshing_tokens', set())
+        # No refresher thread, see queue_refreshes()
+        attributes.setdefault('refresher_pid', os.getpid())
+        attributes['serverInterface'] = lambda self: iface
+        test_klass = type('Test%s' % klass.__name__, (klass,), attributes)
+        # QgsServerFilter only accepts a real QgsServerInterface: its
+        # methods are not used by the filters under test
+        return test_klass.__new__(test_klass)